@@ -0,0 +1,73 @@
+"""
+Benchmark for searching authors.
+
+Creates a database with 100000 authors and measures the trigram index search against the previous ILIKE scan.
+
+Usage: python benchmarks/authors.py [n_authors]
+"""
+import random
+import string
+import sys
+import tempfile
+from time import time
+
+from sqlalchemy import or_
+
+from litrevai.model.database import Database
+from litrevai.model.models import Author
+
+
+def random_name(rng):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10))).capitalize()
+
+
+def create_database(path, n_authors):
+    db = Database(f'sqlite:///{path}/bibliography.sqlite')
+    rng = random.Random(0)
+
+    entries = []
+    for i in range(0, n_authors, 2):
+        authors = f'{random_name(rng)}, {random_name(rng)} and {random_name(rng)}, {random_name(rng)}'
+        entries.append((f'item_{i}', {'title': f'Title {i}', 'author': authors}, None))
+
+    entries.append(('lovelace', {'author': 'Lovelace, Ada'}, None))
+    db.add_items_by_bibtex(entries)
+
+    return db
+
+
+def measure(label, func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        t = time()
+        result = func()
+        timings.append(time() - t)
+    print(f'{label:<40} best {min(timings) * 1000:.1f}ms')
+    return result
+
+
+def search_ilike(db, search_name):
+    with db.Session() as session:
+        return session.query(Author).filter(
+            or_(
+                Author.first_name.ilike(f"%{search_name}%"),
+                Author.last_name.ilike(f"%{search_name}%"),
+                Author.full_name.ilike(f"%{search_name}%")
+            )
+        ).all()
+
+
+def main(n_authors=100000):
+    with tempfile.TemporaryDirectory() as path:
+        db = create_database(path, n_authors)
+        print(f'{n_authors} authors')
+
+        measure('ILIKE scan', lambda: search_ilike(db, 'Lovelace'))
+        df = measure('Trigram index', lambda: db.search_authors('lovelace'))
+        measure('Trigram index (fuzzy)', lambda: db.search_authors('lovlace', fuzzy=True))
+
+        assert df.iloc[0]['last_name'] == 'Lovelace'
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
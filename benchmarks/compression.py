@@ -0,0 +1,95 @@
+"""
+Benchmark for the compressed storage of full texts and response contexts.
+
+Creates a database in which the texts are stored uncompressed (as written by earlier versions), measures the file
+size and the latency of reading all texts, migrates it with Database.compress_texts and measures again. The size of the
+keyword search index is reported as well, it does not store the texts.
+
+Usage: python benchmarks/compression.py [n_items] [n_queries]
+"""
+import random
+import sys
+import tempfile
+from time import time
+
+from litrevai.model.database import Database
+from litrevai.model.models import ProjectModel, QueryModel, Response
+
+WORDS = ('learning programming students course model study results computational thinking '
+         'assessment teacher novice feedback concept analysis education software').split()
+
+
+def random_text(n_words):
+    return ' '.join(random.choices(WORDS, k=n_words))
+
+
+def create_database(path, n_items, n_queries):
+    db = Database(f'sqlite:///{path}/bibliography.sqlite')
+    random.seed(0)
+
+    # Write plain strings, bypassing the compression of the column types
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('INSERT INTO bibliography_items (key, title, text, synced) VALUES (?, ?, ?, 0)', [
+            (f'item_{i}', f'Title {i}', random_text(5000)) for i in range(n_items)
+        ])
+
+    # The raw inserts bypass the keyword search index
+    db.rebuild_search_index()
+
+    with db.Session() as session:
+        project = ProjectModel(name='Benchmark')
+        queries = [QueryModel(name=f'query_{q}', question='?', type='open', project=project) for q in range(n_queries)]
+        session.add_all([project, *queries])
+        session.commit()
+        query_ids = [query.id for query in queries]
+
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('INSERT INTO responses (query_id, item_key, text, context) VALUES (?, ?, ?, ?)', [
+            (query_id, f'item_{i}', 'Answer', random_text(1500)) for query_id in query_ids for i in range(n_items)
+        ])
+
+    return db
+
+
+def measure(label, func):
+    t = time()
+    result = func()
+    print(f'{label:<40} {time() - t:.3f}s')
+    return result
+
+
+def index_size(db):
+    # Requires SQLite compiled with the dbstat table, which is the default of the Python builds
+    with db.engine.connect() as connection:
+        return connection.exec_driver_sql(
+            "SELECT sum(pgsize) FROM dbstat WHERE name LIKE 'items_fts%'"
+        ).scalar()
+
+
+def read_contexts(db):
+    with db.Session() as session:
+        return session.query(Response.context).all()
+
+
+def main(n_items=1000, n_queries=10):
+    with tempfile.TemporaryDirectory() as path:
+        db = create_database(path, n_items, n_queries)
+        keys = [f'item_{i}' for i in range(n_items)]
+        print(f'{n_items} items, {n_queries} queries')
+
+        print(f'Size uncompressed: {db.size / 1e6:.1f} MB')
+        print(f'Size of the keyword index: {index_size(db) / 1e6:.1f} MB')
+        measure('Read texts (uncompressed)', lambda: db.get_texts(keys))
+        measure('Read contexts (uncompressed)', lambda: read_contexts(db))
+
+        sizes = measure('Migration', lambda: db.compress_texts())
+        print(f'Size compressed: {sizes["size_after"] / 1e6:.1f} MB')
+        print(f'Size of the keyword index: {index_size(db) / 1e6:.1f} MB')
+        texts = measure('Read texts (compressed)', lambda: db.get_texts(keys))
+        measure('Read contexts (compressed)', lambda: read_contexts(db))
+
+        assert texts.str.len().min() > 0
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
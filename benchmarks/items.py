@@ -0,0 +1,75 @@
+"""
+Benchmark for listing the items of the bibliography.
+
+Creates a database with 20000 items with full texts, three authors per item, a library, collections and tags
+and measures Database.items against hydrating ORM objects with BibliographyItem.to_df.
+
+Usage: python benchmarks/items.py [n_items] [text_length]
+"""
+import sys
+import tempfile
+from time import time
+
+from litrevai.model.database import Database
+from litrevai.model.models import Author, BibliographyItem, Collection, Library, Tag
+
+
+def create_database(path, n_items, text_length):
+    db = Database(f'sqlite:///{path}/bibliography.sqlite')
+
+    with db.Session() as session:
+        library = Library(name='Personal')
+        collections = [Collection(name=f'Collection {i}', library=library) for i in range(10)]
+        tags = [Tag(name=f'Tag {i}') for i in range(10)]
+        authors = [Author(first_name=f'First {i}', last_name=f'Last {i}') for i in range(n_items // 2)]
+        session.add_all([library, *collections, *tags, *authors])
+
+        text = 'Lorem ipsum dolor sit amet. ' * (text_length // 28)
+
+        for i in range(n_items):
+            session.add(BibliographyItem(
+                key=f'item_{i}',
+                title=f'Title {i}',
+                year=2000 + i % 25,
+                text=text,
+                library=library,
+                authors=[authors[(i + j) % len(authors)] for j in range(3)],
+                collections=[collections[i % len(collections)]],
+                tags=[tags[i % len(tags)], tags[(i + 1) % len(tags)]],
+            ))
+        session.commit()
+
+    return db
+
+
+def measure(label, func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        t = time()
+        result = func()
+        timings.append(time() - t)
+    print(f'{label:<40} best {min(timings):.3f}s')
+    return result
+
+
+def hydrate_orm(db):
+    with db.Session() as session:
+        items = session.query(BibliographyItem).all()
+        return BibliographyItem.to_df(items)
+
+
+def main(n_items=20000, text_length=20000):
+    with tempfile.TemporaryDirectory() as path:
+        db = create_database(path, n_items, text_length)
+        print(f'{n_items} items with {text_length} characters of text')
+
+        measure('ORM objects and to_df', lambda: hydrate_orm(db), repeat=1)
+        df = measure('Database.items', lambda: db.items)
+        measure('Database.get_items(include_text=True)', lambda: db.get_items(include_text=True), repeat=1)
+        measure('Database.get_item_tags', lambda: db.get_item_tags(df.index))
+
+        assert len(df) == n_items
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
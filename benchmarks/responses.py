@@ -0,0 +1,81 @@
+"""
+Benchmark for loading the responses of a project.
+
+Creates a database with 5000 items and 20 queries of different prompt types and measures
+loading Project.responses while the responses are parsed on read and after the parsed values were stored with
+Database.reparse_responses.
+
+Usage: python benchmarks/responses.py [n_items] [n_queries]
+"""
+import json
+import sys
+import tempfile
+from time import time
+
+from litrevai.model.database import Database
+from litrevai.model.models import ProjectModel, QueryModel, Response
+
+ANSWERS = {
+    'yes_no': lambda i: 'Yes, the study reports on it.' if i % 3 else 'No.',
+    'likert': lambda i: f'{i % 7 - 3} The context partially supports the statement.',
+    'list': lambda i: '\n'.join(f'- Concept {j}' for j in range(i % 5 + 1)),
+    'open': lambda i: f'The article describes approach number {i}.',
+}
+
+
+def create_database(path, n_items, n_queries):
+    db = Database(f'sqlite:///{path}/bibliography.sqlite')
+    types = list(ANSWERS)
+
+    with db.Session() as session:
+        project = ProjectModel(name='Benchmark')
+        session.add(project)
+        session.flush()
+
+        for q in range(n_queries):
+            prompt_type = types[q % len(types)]
+            params = {'n': 5} if prompt_type == 'list' else {}
+            query = QueryModel(
+                name=f'query_{q}',
+                question='Benchmark question?',
+                type=prompt_type,
+                params=json.dumps(params),
+                project_id=project.id
+            )
+            session.add(query)
+            session.flush()
+
+            session.add_all([
+                Response(query_id=query.id, item_key=f'item_{i}', text=ANSWERS[prompt_type](i))
+                for i in range(n_items)
+            ])
+        session.commit()
+
+        return db, project.id
+
+
+def measure(label, func, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        t = time()
+        result = func()
+        timings.append(time() - t)
+    print(f'{label:<40} best {min(timings):.3f}s  first {timings[0]:.3f}s')
+    return result
+
+
+def main(n_items=5000, n_queries=20):
+    with tempfile.TemporaryDirectory() as path:
+        db, project_id = create_database(path, n_items, n_queries)
+        print(f'{n_items} items x {n_queries} queries')
+
+        # Reading does not store the parsed values
+        measure('Project responses (parsed on read)', lambda: db.get_responses_for_project(project_id))
+        measure('Reparse responses', lambda: db.reparse_responses(), repeat=1)
+        df = measure('Project responses (stored values)', lambda: db.get_responses_for_project(project_id))
+
+        assert df.shape == (n_items, n_queries)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
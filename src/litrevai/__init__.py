@@ -1,7 +1,7 @@
 from .literature_review import LiteratureReview
 from .prompt import ListPrompt, YesNoPrompt, OptionsPrompt, OpenPrompt, LikertPrompt
 from .zotero_connector import ZoteroConnector
-from .llm import HuggingfaceModel, OpenAIModel
+from .llm import HuggingfaceModel, OpenAIModel, ModelCascade
 
 
 
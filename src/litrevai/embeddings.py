@@ -0,0 +1,266 @@
+"""
+Process-wide registry of sentence embedding models.
+
+Loading an embedding model takes seconds and keeps hundreds of megabytes (or GPU memory) resident, so the vector store
+and the topic models share one instance per (model name, device) instead of loading their own copies.
+"""
+import gc
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = 'BAAI/bge-large-en-v1.5'
+
+_models: Dict[Tuple[str, str], 'SentenceTransformer'] = {}
+_lock = threading.Lock()
+
+
+def get_device() -> str:
+    """
+    Returns the best available torch device.
+    """
+    import torch
+
+    if torch.backends.mps.is_available():
+        return 'mps'
+    elif torch.cuda.is_available():
+        return 'cuda'
+    else:
+        return 'cpu'
+
+
+def get_embedding_model(
+        name: str = DEFAULT_EMBEDDING_MODEL,
+        device: str | None = None,
+        trust_remote_code: bool = False
+) -> 'SentenceTransformer':
+    """
+    Returns the shared SentenceTransformer for the model name and device and loads it on first use.
+
+    :param name: Name or path of the SentenceTransformer model.
+    :param device: Torch device. Defaults to the best available device.
+    :param trust_remote_code: Allows custom model code from the Hugging Face Hub when the model is loaded.
+    """
+    device = device or get_device()
+    key = (name, device)
+
+    with _lock:
+        if key not in _models:
+            from sentence_transformers import SentenceTransformer
+
+            logger.info(f'Loading embedding model {name} on {device}')
+            _models[key] = SentenceTransformer(name, device=device, trust_remote_code=trust_remote_code)
+
+        return _models[key]
+
+
+def unload_embedding_model(name: str | None = None, device: str | None = None) -> int:
+    """
+    Removes models from the registry and releases their memory. Objects that still hold a reference to a model
+    keep it alive until they are deleted.
+
+    :param name: Name of the model. If None, models of all names are unloaded.
+    :param device: Device of the model. If None, models on all devices are unloaded.
+    :return: Number of unloaded models
+    """
+    with _lock:
+        keys = [
+            key for key in _models
+            if (name is None or key[0] == name) and (device is None or key[1] == device)
+        ]
+        for key in keys:
+            del _models[key]
+
+    gc.collect()
+
+    # A model on a CUDA device was loaded by torch, so torch is only imported if it was imported before
+    torch = sys.modules.get('torch')
+    if torch is not None and any(device.startswith('cuda') for _, device in keys):
+        torch.cuda.empty_cache()
+
+    return len(keys)
+
+
+def loaded_embedding_models() -> List[Tuple[str, str]]:
+    """
+    Returns the (name, device) pairs of all loaded models.
+    """
+    with _lock:
+        return list(_models)
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of text embeddings keyed by the model name and the SHA-1 hash of the text.
+
+    Every call to encode that computes new embeddings adds a shard of two .npy files to the directory of the
+    model: the hashes and the float32 embedding matrix. Shards are memory-mapped when they are read,
+    so opening a large cache is cheap. Shards have unique names and are written atomically, so several processes
+    can share a cache. Once there are more than max_shards shards, they are merged into one.
+    """
+
+    def __init__(self, path: str, model_name: str = DEFAULT_EMBEDDING_MODEL, max_shards: int = 32):
+        """
+        :param path: Root directory of the cache.
+        :param model_name: Name of the embedding model. Every model has its own directory.
+        :param max_shards: Number of shards above which the shards are compacted.
+        """
+        self.model_name = model_name
+        self.path = os.path.join(path, re.sub(r'[^\w.-]+', '_', model_name))
+        self.max_shards = max_shards
+        os.makedirs(self.path, exist_ok=True)
+
+        self._shards = []
+        self._shard_ids = []
+        self._index = {}
+        self._load()
+
+        if len(self._shards) > self.max_shards:
+            self.compact()
+
+    def _list_shards(self) -> List[str]:
+        return sorted(
+            file[len('shard_'):-len('.keys.npy')]
+            for file in os.listdir(self.path) if file.startswith('shard_') and file.endswith('.keys.npy')
+        )
+
+    def _load(self):
+        # Another process may compact the cache while the shards are loaded. Removed shards are skipped and the
+        # directory is listed again until the merged shard is loaded.
+        skipped = set()
+
+        while True:
+            loaded = set(self._shard_ids)
+            shards = [shard_id for shard_id in self._list_shards() if shard_id not in loaded | skipped]
+
+            if not shards:
+                break
+
+            for shard_id in shards:
+                try:
+                    self._add_shard(shard_id)
+                except FileNotFoundError:
+                    logger.debug(f'Shard {shard_id} was removed while loading the cache')
+                    skipped.add(shard_id)
+
+    def _prefix(self, shard_id: str) -> str:
+        return os.path.join(self.path, f'shard_{shard_id}')
+
+    def _add_shard(self, shard_id: str):
+        prefix = self._prefix(shard_id)
+        hashes = np.load(f'{prefix}.keys.npy')
+        vectors = np.load(f'{prefix}.npy', mmap_mode='r')
+
+        position = len(self._shards)
+        self._shards.append(vectors)
+        self._shard_ids.append(shard_id)
+        for row, text_hash in enumerate(hashes):
+            self._index[text_hash] = (position, row)
+
+    @staticmethod
+    def hash(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, text: str):
+        return self.hash(text) in self._index
+
+    def encode(self, texts: List[str], model: 'SentenceTransformer', **kwargs) -> np.ndarray:
+        """
+        Returns the embeddings of the texts. Only texts that are not cached yet are encoded by the model.
+
+        :param texts: Texts to embed
+        :param model: SentenceTransformer used for texts that are not cached.
+        :param kwargs: Arguments passed to SentenceTransformer.encode
+        :return: Embedding matrix with one row per text
+        """
+        hashes = [self.hash(text) for text in texts]
+
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in self._index:
+                missing[text_hash] = text
+
+        if missing:
+            logger.info(f'Encoding {len(missing)} of {len(texts)} texts, the others are cached')
+            vectors = np.asarray(model.encode(list(missing.values()), **kwargs), dtype=np.float32)
+            self._write_shard(list(missing), vectors)
+
+            if len(self._shards) > self.max_shards:
+                self.compact()
+
+        if len(texts) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+
+        return np.stack([self._shards[shard][row] for shard, row in map(self._index.get, hashes)])
+
+    @staticmethod
+    def _save(path: str, array: np.ndarray):
+        # Written to a temporary file first, so that other processes never read a partial file
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, array)
+        os.replace(tmp_path, path)
+
+    def _write_shard(self, hashes: List[str], vectors: np.ndarray):
+        # Unique names, so that processes sharing the cache never write the same shard
+        shard_id = f'{time.time_ns():020d}_{uuid.uuid4().hex[:8]}'
+        prefix = self._prefix(shard_id)
+
+        # The keys are written last, so incomplete shards are ignored
+        self._save(f'{prefix}.npy', vectors)
+        self._save(f'{prefix}.keys.npy', np.array(hashes))
+
+        self._add_shard(shard_id)
+
+    def compact(self):
+        """
+        Merges all shards into one.
+        """
+        if len(self._shards) <= 1:
+            return
+
+        hashes = list(self._index)
+        vectors = np.stack([self._shards[shard][row] for shard, row in self._index.values()])
+        old_shard_ids = self._shard_ids
+
+        self._shards = []
+        self._shard_ids = []
+        self._index = {}
+        self._write_shard(hashes, vectors)
+
+        # Shards written by other processes in the meantime are kept
+        for shard_id in old_shard_ids:
+            for suffix in ['.keys.npy', '.npy']:
+                try:
+                    os.remove(f'{self._prefix(shard_id)}{suffix}')
+                except OSError as e:
+                    # Already removed by another process or still memory-mapped by one (Windows). Leftover shards
+                    # only duplicate embeddings of the merged shard.
+                    if not isinstance(e, FileNotFoundError):
+                        logger.warning(f'Could not remove shard {shard_id}: {e}')
+
+        logger.info(f'Compacted {len(old_shard_ids)} shards with {len(hashes)} embeddings')
+
+    def clear(self):
+        """
+        Deletes all cached embeddings of the model.
+        """
+        self._shards = []
+        self._shard_ids = []
+        self._index = {}
+        for file in os.listdir(self.path):
+            if file.startswith('shard_'):
+                os.remove(os.path.join(self.path, file))
@@ -0,0 +1,125 @@
+import logging
+from typing import List
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Tokens added by the chat format for every message and for the reply priming
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Columns of the records of a dry run
+ESTIMATE_COLUMNS = ['query', 'key', 'input_tokens', 'output_tokens', 'upper_bound']
+
+
+def _get_encoding(model: str | None = None):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+
+    if model:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+
+    return tiktoken.get_encoding('cl100k_base')
+
+
+def count_tokens(messages: List[dict] | str, model: str | None = None) -> int:
+    """
+    Counts the tokens of a chat using a local tokenizer.
+    Uses tiktoken if it is installed and falls back to an approximation of four characters per token otherwise.
+
+    :param messages: List of chat messages or a plain string.
+    :param model: Optional model name to select the matching tokenizer.
+    :return: Number of tokens
+    """
+    encoding = _get_encoding(model)
+
+    if encoding is None:
+        logger.info('tiktoken is not installed, token counts are approximated.')
+
+        def count(text):
+            return len(text) // 4 + 1
+    else:
+        def count(text):
+            return len(encoding.encode(text, disallowed_special=()))
+
+    if isinstance(messages, str):
+        return count(messages)
+
+    n_tokens = TOKENS_PER_REPLY
+    for message in messages:
+        n_tokens += TOKENS_PER_MESSAGE + count(message['role']) + count(message['content'])
+
+    return n_tokens
+
+
+class CostEstimate:
+    """
+    Result of a dry run. Holds the number of input and output tokens for every query and item that would be run.
+    """
+
+    df: pd.DataFrame
+
+    def __init__(self, df: pd.DataFrame, input_price: float | None = None, output_price: float | None = None):
+        """
+        :param df: DataFrame with the columns `query`, `key`, `input_tokens` and `output_tokens`. The optional column
+            `upper_bound` flags items that may be filtered out by the queries the query depends on.
+        :param input_price: Price per one million input tokens.
+        :param output_price: Price per one million output tokens.
+        """
+        self.input_price = input_price
+        self.output_price = output_price
+
+        df = df.copy()
+        df['cost'] = (
+            df['input_tokens'] * (input_price or 0) + df['output_tokens'] * (output_price or 0)
+        ) / 1_000_000
+
+        self.df = df
+
+    @property
+    def input_tokens(self) -> int:
+        return int(self.df['input_tokens'].sum())
+
+    @property
+    def output_tokens(self) -> int:
+        return int(self.df['output_tokens'].sum())
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    @property
+    def cost(self) -> float:
+        return float(self.df['cost'].sum())
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Returns the distribution of input tokens, the total tokens and costs and the number of upper bound items per
+        query.
+        :return:
+        """
+        grouped = self.df.groupby('query')
+
+        summary = grouped['input_tokens'].describe()[['count', 'mean', 'min', '50%', 'max']]
+        summary = summary.rename({'50%': 'median'}, axis=1)
+        summary['input_tokens'] = grouped['input_tokens'].sum()
+        summary['output_tokens'] = grouped['output_tokens'].sum()
+        summary['cost'] = grouped['cost'].sum()
+        summary['count'] = summary['count'].astype(int)
+
+        if 'upper_bound' in self.df.columns:
+            summary['upper_bound'] = grouped['upper_bound'].sum().astype(int)
+
+        return summary
+
+    def __repr__(self):
+        s = f'CostEstimate(calls={len(self.df)}, input_tokens={self.input_tokens}, output_tokens={self.output_tokens}'
+        if self.input_price is not None or self.output_price is not None:
+            s += f', cost={self.cost:.4f}'
+        return s + ')'
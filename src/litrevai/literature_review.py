@@ -1,15 +1,21 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from random import randint
-from typing import List, Mapping
+from time import time
+from typing import List, Mapping, Literal
 
 import bibtexparser
 import pandas as pd
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import Session, undefer
 from tqdm.auto import tqdm
 import os
-from .llm import BaseLLM
+from .estimate import ESTIMATE_COLUMNS, CostEstimate, count_tokens
+from .llm import BaseLLM, ModelCascade
 from .pdf2text import pdf2text
 from .query import Query
-from litrevai.model.models import ProjectModel, Response, QueryModel, Library, Collection, BibliographyItem, EntryTypes, Author
+from litrevai.model.models import ProjectModel, Response, QueryModel, Library, Collection, BibliographyItem, EntryTypes, Author, \
+    item_author_association
 from .util import parse_bibtex, _resolve_item_keys
 from .project import Project
 from litrevai.model.database import Database
@@ -32,14 +38,25 @@ class LiteratureReview:
     vs: VectorStore
     llm: BaseLLM | None = None
 
-    def __init__(self, path='./db', llm=None):
+    def __init__(self, path='./db', llm=None, context_mode: Literal['text', 'chunks'] = 'text',
+                 db_profile: str | dict = 'default'):
+        """
+        :param path: Directory containing the database and the vector store.
+        :param llm: Language model used for RAG and topic labels.
+        :param context_mode: 'text' stores the formatted context with every response. 'chunks' only stores
+            references to the retrieved chunks and reconstructs the context from the vector store on demand.
+        :param db_profile: SQLite profile, see Database. 'performance' enables WAL, which is recommended
+            for run_project with several workers on a local disk.
+        """
 
         if not os.path.exists(path):
             os.mkdir(path)
 
-        self.db = Database(f'sqlite:///{path}/bibliography.sqlite')
+        self.path = path
+        self.db = Database(f'sqlite:///{path}/bibliography.sqlite', profile=db_profile)
         self.vs = VectorStore(self, uri=f'{path}/lancedb')
         self.llm = llm
+        self.context_mode = context_mode
         self.rag = self.vs.rag
 
         self.Session = self.db.Session
@@ -51,9 +68,19 @@ class LiteratureReview:
         :return:
         """
         with self.Session() as session:
-            item = session.get(BibliographyItem, item_key)
+            item = session.get(BibliographyItem, item_key, options=[undefer(BibliographyItem.text)])
         return item
 
+    def get_texts(self, items: ItemCollection) -> pd.Series:
+        """
+        Returns the full texts of the given items.
+
+        :param items: Keys of the items or a DataFrame indexed by them.
+        :return: Series with the texts indexed by the item keys.
+        """
+        item_keys = _resolve_item_keys(items)
+        return self.db.get_texts(item_keys)
+
     def get_project_by_id(self, project_id) -> Project:
         project = Project(self, project_id)
         return project
@@ -65,8 +92,8 @@ class LiteratureReview:
     @property
     def collections(self):
         with self.Session() as session:
-            collections = session.query(Collection).all()
-            d = {collection.id: f'{collection.name} ({collection.path})' for collection in collections}
+            collections = session.query(Collection.id, Collection.name, Collection.path).all()
+            d = {collection_id: f'{name} ({path})' for collection_id, name, path in collections}
         return d
 
     def get_collection(self, collection_id):
@@ -75,25 +102,59 @@ class LiteratureReview:
         :param collection_id:
         :return:
         """
-        with self.Session() as session:
-            collection = session.get(Collection, collection_id)
-            items = collection.get_items()
-
-        df = BibliographyItem.to_df(items)
+        df = self.db.read_collection_items(collection_id)
         return df
 
-    def search(self, search_phrase: str, n: int = 10, items: ItemCollection = None) -> pd.DataFrame:
+    def keyword_search(
+            self,
+            query: str,
+            n: int | None = 10,
+            items: ItemCollection = None,
+            raw: bool = False
+    ) -> pd.DataFrame:
+        """
+        Searches the titles, abstracts, keywords and full texts for keywords. The results are ranked by bm25 and
+        contain a snippet of the best matching passage with the matches enclosed in brackets.
+
+        :param query: Search terms. All terms have to match. If raw is True, the query is passed as FTS5 query
+            and may use operators like OR, NEAR and prefixes (e.g. `"language model" OR llm*`).
+        :param n: Maximum number of items. If None, all matching items are returned.
+        :param items: The collection of items to search within
+        :param raw: If True, the query is not quoted.
+        :return: DataFrame with the score, the snippet and the metadata of the matching items.
+        """
+        item_keys = _resolve_item_keys(items)
+
+        results = self.db.keyword_search(query, n=n, keys=item_keys, raw=raw)
+
+        items = self.db.read_items(BibliographyItem.key.in_(results.index.tolist()))
+
+        return results.join(items, how='left')
+
+    def search(
+            self,
+            search_phrase: str,
+            n: int = 10,
+            items: ItemCollection = None,
+            keyword: str | None = None
+    ) -> pd.DataFrame:
         """
         Performs a full-text similarity search based on the provided search phrase.
 
         :param search_phrase: The phrase to search for within the items
         :param n: The number of items to return
         :param items: The collection of items to search within
+        :param keyword: Optional keyword query. Only items matching the keywords are searched (see keyword_search).
         :return: A DataFrame containing the matching text passages and their respective sources.
         """
 
         item_keys = _resolve_item_keys(items)
 
+        if keyword is not None:
+            item_keys = self.db.keyword_search(keyword, n=None, keys=item_keys, snippets=False).index.tolist()
+            if len(item_keys) == 0:
+                return pd.DataFrame()
+
         context: pd.DataFrame = self.vs.get_context(search_phrase, n=n, items=item_keys)
 
         def aggregate(context):
@@ -122,16 +183,14 @@ class LiteratureReview:
         :param path: File-Path like string. Example: Library/Path/To/Collection
         :return: DataFrame containing all items within that collection.
         """
-        with self.Session() as session:
-            collections = session.query(Collection).all()
+        collection_id = self.db.get_collection_id_by_path(path)
 
-            for collection in collections:
-                if collection.path == path:
-                    items = collection.get_items()
-                    df = BibliographyItem.to_df(items)
-                    return df
+        if collection_id is None:
             raise Exception(f'There is no collection with the path {path}')
 
+        df = self.db.read_collection_items(collection_id)
+        return df
+
     def to_bibtex(self, items, file_path: str | None = None) -> str:
         """
         Exports the items to a bibtex string.
@@ -195,8 +254,8 @@ class LiteratureReview:
         with self.Session() as session:
             library = session.get(Library, library_id)
             name = library.name
-            items = library.items
-            df = BibliographyItem.to_df(items)
+
+        df = self.db.read_items(BibliographyItem.library_id == library_id)
         return name, df
 
     @property
@@ -295,19 +354,49 @@ class LiteratureReview:
         self.sync_vector_store()
         return item
 
-    def import_csv(self, file_path):
+    def import_csv(
+            self,
+            file_path: str,
+            project: int | Project = None,
+            chunksize: int = 1000,
+            update_existing: bool = False,
+            sync: bool = True
+    ) -> int:
         """
         Imports BibliogprahyItems from a CSV-file. Expects `key` and `text` to be in column names.
 
+        The file is streamed in chunks. Every chunk is inserted in a single transaction and embedded before the next
+        chunk is read, so the memory usage is bounded by the chunk size and not by the size of the file.
+
         :param file_path:
-        :return:
+        :param project: Optional Project or Project ID. Items are automatically added to the project
+        :param chunksize: Number of rows read, inserted and embedded at once.
+        :param update_existing: If True, existing items are updated with the values of the file.
+        :param sync: If False, the vector store is not synced.
+        :return: Number of imported rows
         """
-        df = pd.read_csv(file_path).set_index('key')
+        project_id = self._resolve_project_id(project)
+
+        n = 0
+        progress_bar = tqdm(desc='Importing CSV', unit=' rows')
+
+        for df in pd.read_csv(file_path, chunksize=chunksize, dtype={'key': str}):
+            entries = []
+            for record in df.to_dict('records'):
+                bibtex = {column: value for column, value in record.items() if not pd.isna(value)}
+                entries.append((bibtex['key'], bibtex, bibtex.get('text')))
+
+            self.db.add_items_by_bibtex(entries, project_id=project_id, update_existing=update_existing)
+
+            if sync:
+                self.sync_vector_store(keys=df['key'].tolist(), replace=update_existing)
 
-        for key, row in df.iterrows():
-            text = row['text']
-            bibtex = row.to_dict()
-            self.import_item(key=key, text=text, bibtex=bibtex)
+            n += len(df)
+            progress_bar.update(len(df))
+
+        progress_bar.close()
+
+        return n
 
     def import_txt(self, item_key: str, file_path: str, bibtex: dict):
         with self.Session() as session:
@@ -316,35 +405,97 @@ class LiteratureReview:
 
             self.import_item(key=item_key, text=text, bibtex=bibtex)
 
-    def import_bibtex(self, path_to_bibtex: str, project: int | Project = None):
+    def import_bibtex(
+            self,
+            path_to_bibtex: str,
+            project: int | Project = None,
+            workers: int | None = None,
+            batch_size: int = 100
+    ) -> pd.DataFrame:
         """
         Imports BibliographyItems into the database from a Bibtex File. The entries are expected to have a `file` field
         containing the absolute path to the corresponding PDF file.
 
+        The import runs as a pipeline: the PDFs are extracted in parallel processes, extracted items are inserted
+        in batches while the extraction continues and the vector store is synced once at the end.
+        PDFs of items that already exist are not extracted again.
+
         :param path_to_bibtex:
-        :param project_id: Optional Project ID. Items are automatically added to the project
-        :return:
+        :param project: Optional Project or Project ID. Items are automatically added to the project
+        :param workers: Number of processes extracting PDFs. Defaults to the number of CPUs.
+        :param batch_size: Number of items inserted per transaction.
+        :return: DataFrame with the number of items, the duration and the throughput of every stage.
         """
 
         project_id = self._resolve_project_id(project)
+        stats = {}
 
-        entries = parse_bibtex(path_to_bibtex)
-        for entry in entries:
+        t = time()
+        entries = {}
+        for entry in parse_bibtex(path_to_bibtex):
             filepath = entry.get('file')
             if filepath is None:
                 print(f'No file associated with this entry: {entry}')
                 continue
 
-            filepath = os.path.join(os.path.dirname(path_to_bibtex), filepath)
+            entry['file'] = os.path.join(os.path.dirname(path_to_bibtex), filepath)
+            entries[entry.get('ID')] = entry
+        stats['parse'] = (len(entries), time() - t)
+
+        existing = self.db.get_existing_keys(entries)
+        if project_id and existing:
+            # Existing items only need to be added to the project
+            self.db.add_items_by_bibtex([(key, entries[key], None) for key in existing], project_id=project_id)
 
-            text = pdf2text(filepath)
+        pending = [key for key in entries if key not in existing]
+        batch = []
+        insert_time = 0
+        n_inserted = 0
 
-            key = entry.get('ID')
+        def insert_batch():
+            nonlocal insert_time, n_inserted
+            t_insert = time()
+            n_inserted += len(self.db.add_items_by_bibtex(batch, project_id=project_id))
+            insert_time += time() - t_insert
+            batch.clear()
+
+        t = time()
+        progress_bar = tqdm(desc='Extracting PDFs', total=len(pending))
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(pdf2text, entries[key]['file']): key for key in pending}
+
+            for future in as_completed(futures):
+                key = futures[future]
+                progress_bar.update()
+                try:
+                    text = future.result()
+                except Exception as e:
+                    logger.error(f'Extracting {entries[key]["file"]} failed: {e}')
+                    continue
 
-            item = self.import_item(key, text, entry)
+                batch.append((key, entries[key], text))
+                if len(batch) >= batch_size:
+                    insert_batch()
 
-            if project_id:
-                self.db.add_item_to_project(key, project_id)
+            if batch:
+                insert_batch()
+
+        progress_bar.close()
+        stats['extract'] = (len(pending), time() - t - insert_time)
+        stats['insert'] = (n_inserted, insert_time)
+
+        t = time()
+        n_synced = self.sync_vector_store()
+        stats['sync'] = (n_synced, time() - t)
+
+        df = pd.DataFrame.from_dict(stats, orient='index', columns=['items', 'seconds'])
+        df['items_per_second'] = df['items'] / df['seconds'].where(df['seconds'] > 0)
+        df.index.name = 'stage'
+
+        logger.info(f'Imported {n_inserted} items from {path_to_bibtex}:\n{df}')
+
+        return df
 
     @property
     def libraries(self):
@@ -354,20 +505,69 @@ class LiteratureReview:
         d = {library.id: library.name for library in libraries}
         return d
 
-    def sync_vector_store(self):
+    def sync_vector_store(self, batch_size: int = 100, keys: List[str] | None = None, replace: bool = False) -> int:
+        """
+        Adds the texts of all items that are not synced yet to the vector store.
+        The texts are loaded and embedded in batches, so the memory usage is bounded by the batch size.
+
+        :param batch_size: Number of items per batch
+        :param keys: Optional keys to restrict the sync to.
+        :param replace: If True, chunks that are already stored for unsynced items are replaced. The chunk references
+            of their responses are removed, see _detach_chunk_references.
+        :return: Number of synced items
+        """
+        statement = select(BibliographyItem.key).where(
+            BibliographyItem.synced == False,
+            BibliographyItem.text.isnot(None)
+        )
+
         with self.db.Session() as session:
-            items = session.query(BibliographyItem).where(BibliographyItem.synced == False).all()
+            if keys is None:
+                keys = session.scalars(statement).all()
+            else:
+                keys = [
+                    key for i in range(0, len(keys), 500)
+                    for key in session.scalars(statement.where(BibliographyItem.key.in_(keys[i:i + 500])))
+                ]
+
+        progress_bar = tqdm(desc='Syncing Vector Store', total=len(keys))
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            texts = self.db.get_texts(batch).dropna()
+            if replace:
+                self._detach_chunk_references(texts.index.tolist())
+            self.vs.add_texts(texts.to_dict(), replace=replace)
+            self.db.set_synced(batch)
+            progress_bar.update(len(batch))
+        progress_bar.close()
+
+        return len(keys)
+
+
+    def _detach_chunk_references(self, keys: List[str]) -> int:
+        """
+        Removes the chunk references of the responses to the given items before their chunks are replaced, as the
+        references would point to the new chunks. Responses that only store the references get their context
+        reconstructed from the old chunks first.
 
-            progress_bar = tqdm(desc='Syncing Vector Store', total=len(items))
-            for item in items:
-                success = self.vs.add_text(item.key, item.text)
-                if success:
-                    item.synced = True
-                else:
-                    logger.warning("Failed to sync item {item.key}: {item.text}")
-                progress_bar.update()
-            session.commit()
+        :param keys: Keys of the items whose chunks are replaced.
+        :return: Number of updated responses
+        """
+        with self.db.session_scope() as session:
+            responses = session.query(Response).where(
+                Response.item_key.in_(keys),
+                Response.chunks.is_not(None)
+            ).all()
+
+            for response in responses:
+                if response.context is None:
+                    response.context = self.vs.format_chunks(json.loads(response.chunks))
+                response.chunks = None
 
+        if responses:
+            logger.info(f'Removed the chunk references of {len(responses)} responses')
+
+        return len(responses)
 
     def import_zotero(
             self,
@@ -389,60 +589,91 @@ class LiteratureReview:
         self.sync_vector_store()
 
 
-    def search_author(self, search_name: str) -> pd.DataFrame:
+    def search_author(self, search_name: str, n: int | None = 20, fuzzy: bool = False) -> pd.DataFrame:
         """
-        Search for authors by their name.
+        Search for authors by their name. The search ignores case and accents and the words of the name may be
+        given in any order and may be incomplete.
+
         :param search_name: Name to search for.
-        :return:
+        :param n: Maximum number of authors.
+        :param fuzzy: If True, names with typos are found as well.
+        :return: DataFrame with the first and last names and a relevance score, ordered by the score.
         """
-        items = self.items
-
-        with self.db.Session() as session:
-            authors = self.db.search_author(session, search_name=search_name)
-            df = Author.to_df(authors)
-
-        return df
+        return self.db.search_authors(search_name, n=n, fuzzy=fuzzy)
 
     def get_items_by_author(self, author_id):
-        with self.Session() as session:
-            items = self.db.get_items_by_author(session, author_id)
-            df = BibliographyItem.to_df(items)
+        keys = select(item_author_association.c.bibliography_key).where(
+            item_author_association.c.author_id == author_id
+        )
+        df = self.db.read_items(BibliographyItem.key.in_(keys))
 
         return df
 
 
-    def run_query(self, query_id, include_keys=None, save_responses=True, debug=False, n=10):
-        with self.db.Session() as session:
+    def run_query(self, query_id, include_keys=None, save_responses=True, debug=False, n=10, commit_every=10,
+                  llms: List[BaseLLM] | ModelCascade | None = None):
+        """
+        Runs the query over all items of its project that have no response yet.
+
+        :param query_id: ID of the query to run.
+        :param include_keys: Optional list of item keys to restrict the run to.
+        :param save_responses: If False, responses are generated but not stored.
+        :param debug: Prints every answer if True.
+        :param n: Number of context chunks retrieved per item.
+        :param commit_every: Number of responses that are written to the database in one transaction.
+        :param llms: Optional list of language models ordered from the cheapest to the strongest or a ModelCascade.
+            Uncertain answers are escalated to the next model. Defaults to lr.llm.
+        :return:
+        """
+        if isinstance(llms, list):
+            llms = ModelCascade(llms)
+
+        with self.db.Session(expire_on_commit=False) as session:
             query = session.get(QueryModel, query_id)
             project = query.project
             items = project.items
 
             # Filter for include keys
             if include_keys:
+                include_keys = set(include_keys)
                 items = [item for item in items if item.key in include_keys]
 
-            progress_bar = tqdm(desc=f'Retrieving responses for query {query.id}', total=len(items))
-
-            for item in items:
+            # Skip items that were pruned by the queries this query depends on
+            allowed_keys = self._resolve_dependencies(session, query.id)
+            if allowed_keys is not None:
+                n_items = len(items)
+                items = [item for item in items if item.key in allowed_keys]
+                logger.info(f'{n_items - len(items)} items pruned by dependencies of query {query.id}')
+
+            # Skip items that already have a response for this query
+            answered_keys = self.db.get_answered_keys(session, query.id)
+            pending = [item for item in items if item.key not in answered_keys]
+
+            progress_bar = tqdm(
+                desc=f'Retrieving responses for query {query.id}',
+                total=len(items),
+                initial=len(items) - len(pending)
+            )
 
-                progress_bar.update()
+            prompt = query.prompt
+            uncommitted = 0
 
-                # Check if there is already a response for this query
-                response = session.query(Response).where(
-                    Response.query == query,
-                    Response.item == item
-                ).first()
+            # Number of calls of each tier of the cascade
+            calls_per_tier = [0] * len(llms.llms) if llms is not None else None
 
-                if response:
-                    continue
+            for item in pending:
 
-                prompt = query.prompt
+                context, chunks = self.vs.retrieve(prompt, keys=item.key, n=n, with_chunks=True)
+                messages = prompt.messages(context)
 
-                answer, context = self.vs.rag(
-                    prompt=prompt,
-                    keys=item.key,
-                    n=n
-                )
+                if llms is None:
+                    llm, tier = self.vs.llm, None
+                    answer = llm.generate_text(messages)
+                else:
+                    answer, tier, calls = llms.generate_text(prompt, messages)
+                    llm = llms.llms[tier]
+                    for i, n_calls in enumerate(calls):
+                        calls_per_tier[i] += n_calls
 
                 if debug:
                     print(answer)
@@ -452,11 +683,197 @@ class LiteratureReview:
                         query=query,
                         item=item,
                         text=answer,
-                        context=context
+                        context=context if self.context_mode == 'text' else None,
+                        chunks=json.dumps(chunks),
+                        model=getattr(llm, 'model', None) or type(llm).__name__,
+                        tier=tier
                     )
+                    response.set_value(prompt)
 
                     session.add(response)
-                    session.commit()
+                    uncommitted += 1
+
+                    if uncommitted >= commit_every:
+                        session.commit()
+                        uncommitted = 0
+
+                progress_bar.update()
+
+            session.commit()
+            progress_bar.close()
+
+            if calls_per_tier is not None:
+                logger.info(f'Calls per tier of the cascade for query {query.id}: {calls_per_tier}')
+
+    def get_response_context(self, query_id: int, item_key: str) -> str | None:
+        """
+        Returns the context that was used to answer the query for the item. If only the chunk references were
+        stored, the context is reconstructed from the vector store.
+
+        :param query_id: ID of the query
+        :param item_key: Key of the item
+        :return: The formatted context or None if there is no response.
+        """
+        with self.db.Session() as session:
+            row = session.query(Response.context, Response.chunks).where(
+                Response.query_id == query_id,
+                Response.item_key == item_key
+            ).first()
+
+        if row is None:
+            return None
+
+        context, chunks = row
+
+        if context is None and chunks is not None:
+            context = self.vs.format_chunks(json.loads(chunks))
+
+        return context
+
+    def deduplicate_contexts(self, batch_size: int = 100):
+        """
+        Replaces the stored contexts of existing responses by references to the chunks in the vector store.
+        The chunks are matched by their text and a context is only removed if it can be reconstructed exactly.
+
+        :param batch_size: Number of responses updated per transaction.
+        """
+        with self.db.Session() as session:
+            response_ids = [response_id for response_id, in session.query(Response.id).where(
+                Response.context.is_not(None)
+            ).all()]
+
+        progress_bar = tqdm(desc='Deduplicating contexts', total=len(response_ids))
+        n_replaced = 0
+
+        for i in range(0, len(response_ids), batch_size):
+            with self.db.Session() as session:
+                responses = session.query(Response).where(Response.id.in_(response_ids[i:i + batch_size])).all()
+
+                for response in responses:
+                    chunks = response.chunks and json.loads(response.chunks)
+
+                    if not chunks:
+                        item_chunks = self.vs.get_chunks(response.item_key)
+                        chunks = [
+                            [key, int(chunk), None]
+                            for key, chunk, text in item_chunks.itertuples(index=False)
+                            if text in response.context
+                        ]
+
+                    if chunks and self.vs.format_chunks(chunks) == response.context:
+                        response.chunks = json.dumps(chunks)
+                        response.context = None
+                        n_replaced += 1
+
+                    progress_bar.update()
+
+                session.commit()
+
+        progress_bar.close()
+        logger.info(f'Replaced {n_replaced} of {len(response_ids)} contexts by chunk references')
+
+        return n_replaced
+
+    def estimate_query(
+            self,
+            query_id,
+            include_keys=None,
+            n=10,
+            output_tokens=256,
+            input_price: float | None = None,
+            output_price: float | None = None,
+            cache_context=True
+    ) -> CostEstimate:
+        """
+        Performs a dry run of the query. Retrieves the context and builds the messages for every item that has
+        no response yet, but does not call the language model.
+
+        :param query_id: ID of the query to estimate.
+        :param include_keys: Optional list of item keys to restrict the run to.
+        :param n: Number of context chunks retrieved per item.
+        :param output_tokens: Expected number of tokens per answer.
+        :param input_price: Price per one million input tokens.
+        :param output_price: Price per one million output tokens.
+        :param cache_context: If True, the retrieved contexts are reused by the following run.
+        :return: CostEstimate with the token counts for each item. Items that are only included because a query
+            the query depends on has not answered them yet are flagged as upper_bound.
+        """
+        records = self._estimate_records([query_id], include_keys=include_keys, n=n,
+                                         output_tokens=output_tokens, cache_context=cache_context)
+        return CostEstimate(pd.DataFrame(records, columns=ESTIMATE_COLUMNS),
+                            input_price=input_price, output_price=output_price)
+
+    def estimate_project(
+            self,
+            project_id,
+            include_keys: List[str] | None = None,
+            output_tokens=256,
+            input_price: float | None = None,
+            output_price: float | None = None,
+            cache_context=True
+    ) -> CostEstimate:
+        """
+        Performs a dry run of all queries in the project. See estimate_query.
+        Queries that depend on other queries are estimated for the items that pass their dependencies or have not been
+        answered by them yet. The latter are flagged as upper_bound, as the run may filter them out.
+
+        :param project_id: ID of the project to estimate.
+        :param include_keys: Optional list of item keys to restrict the run to.
+        :param output_tokens: Expected number of tokens per answer.
+        :param input_price: Price per one million input tokens.
+        :param output_price: Price per one million output tokens.
+        :param cache_context: If True, the retrieved contexts are reused by the following run.
+        :return: CostEstimate with the token counts for each query and item.
+        """
+        query_ids = self._sort_queries(project_id)
+
+        # run_project retrieves with the default number of chunks
+        records = self._estimate_records(query_ids, include_keys=include_keys, n=10,
+                                         output_tokens=output_tokens, cache_context=cache_context)
+        return CostEstimate(pd.DataFrame(records, columns=ESTIMATE_COLUMNS),
+                            input_price=input_price, output_price=output_price)
+
+    def _estimate_records(self, query_ids, include_keys=None, n=10, output_tokens=256, cache_context=True):
+        if self.llm is not None:
+            count = self.llm.count_tokens
+        else:
+            count = count_tokens
+
+        records = []
+
+        with self.db.Session() as session:
+            for query_id in query_ids:
+                query = session.get(QueryModel, query_id)
+                keys = [item.key for item in query.project.items]
+
+                if include_keys:
+                    include_keys = set(include_keys)
+                    keys = [key for key in keys if key in include_keys]
+
+                # Items the dependencies have not answered yet may still pass them
+                allowed_keys = self._resolve_dependencies(session, query.id)
+                if allowed_keys is not None:
+                    possible_keys = self._resolve_dependencies(session, query.id, include_unanswered=True)
+                    keys = [key for key in keys if key in possible_keys]
+                else:
+                    allowed_keys = set(keys)
+
+                answered_keys = self.db.get_answered_keys(session, query.id)
+                keys = [key for key in keys if key not in answered_keys]
+
+                n_upper_bound = sum(key not in allowed_keys for key in keys)
+                if n_upper_bound > 0:
+                    logger.warning(f'Query {query.id} is estimated for {n_upper_bound} items that the queries it '
+                                   f'depends on have not answered yet. The estimate is an upper bound.')
+
+                prompt = query.prompt
+
+                for key in tqdm(keys, desc=f'Estimating tokens for query {query.id}', total=len(keys)):
+                    context = self.vs.retrieve(prompt, keys=key, n=n, cache=cache_context)
+                    messages = prompt.messages(context)
+                    records.append((query.name, key, count(messages), output_tokens, key not in allowed_keys))
+
+        return records
 
     def test_query(self, query_id):
         with self.db.Session() as session:
@@ -514,51 +931,92 @@ class LiteratureReview:
 
                 print(response)
 
-    def run_project(self, project_id, include_keys: List[str] | None = None):
+    def _resolve_dependencies(self, session: Session, query_id: int, include_unanswered=False) -> set | None:
         """
-        Runs over all items in a project
+        Returns the keys of all items that pass the dependencies of the query
+        or None if the query does not depend on other queries.
 
-        :param include_keys:
-        :param project_id:
-        :return:
+        :param include_unanswered: If True, items that a dependency has not answered yet pass it.
         """
+        dependencies = self.db.get_query_dependencies(session, query_id)
 
-        with self.db.Session() as session:
-            project = session.get(ProjectModel, project_id)
-
-            items = project.items
-            queries = project.queries
-
-            # Filter for include keys
-            if include_keys:
-                items = [item for item in items if item.key in include_keys]
-
-            for item in tqdm(items, total=len(items), desc='Retrieving responses for project'):
-                for query in queries:
+        if not dependencies:
+            return None
 
-                    response = session.query(Response).where(Response.query == query, Response.item == item).first()
+        if include_unanswered:
+            project_keys = {item.key for item in session.get(QueryModel, query_id).project.items}
 
-                    if response:
-                        continue
+        allowed_keys = None
+        for depends_on_id, value in dependencies.items():
+            keys = set(Query(self, depends_on_id).as_filter(value))
+            if include_unanswered:
+                keys |= project_keys - self.db.get_answered_keys(session, depends_on_id)
+            allowed_keys = keys if allowed_keys is None else allowed_keys & keys
 
-                    prompt = query.prompt
+        return allowed_keys
 
-                    answer, context = self.vs.rag(
-                        prompt=prompt,
-                        keys=item.key,
-                    )
+    def _query_levels(self, project_id) -> List[List[int]]:
+        """
+        Groups the queries of a project into levels. Each query only depends on queries of earlier levels,
+        so the queries within a level can run concurrently.
+        """
+        with self.db.Session() as session:
+            project = session.get(ProjectModel, project_id)
+            query_ids = [query.id for query in project.queries]
+            dependencies = {
+                query_id: set(self.db.get_query_dependencies(session, query_id)) & set(query_ids)
+                for query_id in query_ids
+            }
+
+        levels = []
+        while dependencies:
+            ready = [query_id for query_id, parents in dependencies.items() if not parents]
+            if not ready:
+                raise Exception(f'The dependencies of the queries {list(dependencies)} contain a cycle.')
+            levels.append(ready)
+            for query_id in ready:
+                del dependencies[query_id]
+            for parents in dependencies.values():
+                parents.difference_update(ready)
+
+        return levels
+
+    def _sort_queries(self, project_id) -> List[int]:
+        """
+        Sorts the queries of a project topologically, so that each query runs after the queries it depends on.
+        """
+        return [query_id for level in self._query_levels(project_id) for query_id in level]
 
-                    response = Response(
-                        query=query,
-                        item=item,
-                        text=answer,
-                        context=context
-                    )
+    def run_project(self, project_id, include_keys: List[str] | None = None, commit_every: int = 10,
+                    llms: List[BaseLLM] | ModelCascade | None = None, workers: int = 1):
+        """
+        Runs all queries of a project over its items. Queries run in the order of their dependencies and
+        skip the items that were pruned by the queries they depend on.
 
-                    print(response)
+        :param include_keys:
+        :param project_id:
+        :param commit_every: Number of responses that are written to the database in one transaction.
+        :param llms: Optional model cascade, see run_query.
+        :param workers: Number of queries that run concurrently. Only queries that do not depend on each other
+            run at the same time. With the 'performance' database profile, reads do not wait for the writes of
+            other queries.
+        :return:
+        """
 
-                    session.add(response)
-                    session.commit()
+        if workers <= 1:
+            for query_id in self._sort_queries(project_id):
+                self.run_query(query_id, include_keys=include_keys, commit_every=commit_every, llms=llms)
+            return
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for level in self._query_levels(project_id):
+                futures = [
+                    executor.submit(self.run_query, query_id, include_keys=include_keys,
+                                    commit_every=commit_every, llms=llms)
+                    for query_id in level
+                ]
+                for future in futures:
+                    future.result()
 
     def create_topic_model(self, query_id):
 
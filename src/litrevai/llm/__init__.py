@@ -1,3 +1,4 @@
 from .base import BaseLLM
+from .cascade import ModelCascade
 from .huggingface_endpoint import HuggingfaceModel
 from .openai_endpoint import OpenAIModel
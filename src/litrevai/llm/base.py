@@ -1,5 +1,7 @@
 from dotenv import load_dotenv
 
+from litrevai.estimate import count_tokens
+
 
 
 class BaseLLM:
@@ -21,6 +23,15 @@ class BaseLLM:
         answer = self.generate_text(messages)
         return answer
 
+    def count_tokens(self, messages) -> int:
+        """
+        Counts the tokens of a chat with a local tokenizer. Endpoints with a known tokenizer may override this.
+
+        :param messages:
+        :return:
+        """
+        return count_tokens(messages, model=getattr(self, 'model', None))
+
     def generate_text(
             self,
             messages,
@@ -0,0 +1,71 @@
+from typing import List, Tuple, TYPE_CHECKING
+
+from .base import BaseLLM
+
+if TYPE_CHECKING:
+    from litrevai.prompt import Prompt
+
+
+class ModelCascade:
+    """
+    Runs a list of language models ordered from the cheapest to the strongest.
+    A tier answers first and the answer is only escalated to the next tier if it is uncertain.
+    """
+
+    llms: List[BaseLLM]
+
+    def __init__(self, llms: List[BaseLLM], samples: int = 1):
+        """
+
+        :param llms: Language models ordered from the cheapest to the strongest.
+        :param samples: Number of answers generated per tier (except the last one). If greater than one,
+            an answer is only accepted if the parsed values of all samples agree (self-consistency).
+        """
+        if len(llms) == 0:
+            raise Exception('A model cascade requires at least one language model.')
+
+        self.llms = llms
+        self.samples = samples
+
+    def is_confident(self, prompt: 'Prompt', answers: List[str]) -> bool:
+        """
+        Decides whether the answers of a tier are accepted. Override to implement a custom check.
+
+        :param prompt: Prompt used to parse the answers.
+        :param answers: All samples generated by the tier.
+        :return: True if the first answer is accepted.
+        """
+        values = [prompt.parse_value(answer) for answer in answers if answer is not None]
+
+        if len(values) < len(answers) or values[0] is None:
+            return False
+
+        return all(value == values[0] for value in values[1:])
+
+    def generate_text(self, prompt: 'Prompt', messages, **kwargs) -> Tuple[str | None, int, List[int]]:
+        """
+        Generates an answer with the cheapest tier that is confident.
+
+        :param prompt: Prompt used to parse the answers.
+        :param messages: Chat messages built by the prompt.
+        :param kwargs: Arguments passed to BaseLLM.generate_text
+        :return: Tuple with the answer, the index of the tier that produced it and the number of calls of each tier
+            that was tried.
+        """
+        last_tier = len(self.llms) - 1
+        calls = []
+
+        for tier, llm in enumerate(self.llms):
+
+            if tier == last_tier:
+                calls.append(1)
+                return llm.generate_text(messages, **kwargs), tier, calls
+
+            answers = [llm.generate_text(messages, **kwargs) for _ in range(self.samples)]
+            calls.append(len(answers))
+
+            if self.is_confident(prompt, answers):
+                return answers[0], tier, calls
+
+    def __repr__(self):
+        return f'ModelCascade(llms={self.llms}, samples={self.samples})'
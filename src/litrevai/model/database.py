@@ -1,24 +1,219 @@
+from contextlib import contextmanager
 from typing import List
-from sqlalchemy import create_engine, or_
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import create_engine, event, or_, insert, select, update, bindparam, type_coerce, String, text as sql_text
+from sqlalchemy.sql import func
+from sqlalchemy.orm import Session, sessionmaker, undefer
 from tqdm.auto import tqdm
 from litrevai.acm import import_binder
 from litrevai.pdf2text import pdf2text
 from litrevai.prompt import Prompt
 from .models import *
+from .migrations import migrate
+from . import search_index
 from litrevai.util import timer_func
 from litrevai.zotero_connector import ZoteroConnector
-from litrevai.util import extract_year
+from litrevai.util import extract_year, get_authors_from_author_field
 import logging
 logger = logging.getLogger(__name__)
 
+# Separates the author names aggregated by group_concat
+AUTHOR_SEPARATOR = '\x1f'
+
+# SQLite pragmas applied to every connection
+SQLITE_PROFILES = {
+    'default': {
+        'busy_timeout': 30000,
+    },
+    # Readers do not block the writer (and vice versa) and waiting writers retry instead of failing.
+    # WAL keeps -wal and -shm files next to the database and does not work on network file systems.
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 30000,
+        'cache_size': -64000,  # 64 MB
+        'mmap_size': 268435456,  # 256 MB
+        'temp_store': 'MEMORY',
+    },
+}
+
+
 class Database:
 
-    def __init__(self, url='sqlite:///library.db'):
+    def __init__(self, url='sqlite:///library.db', profile: str | dict = 'default'):
+        """
+        :param url: SQLAlchemy database URL
+        :param profile: Name of a profile in SQLITE_PROFILES or a dict of SQLite pragmas applied to every connection.
+        """
         self.url = url
         self.engine = create_engine(url, echo=False)
+
+        if self.engine.dialect.name == 'sqlite':
+            pragmas = SQLITE_PROFILES[profile] if isinstance(profile, str) else profile
+            event.listen(self.engine, 'connect', lambda connection, record: self._set_pragmas(connection, pragmas))
+
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
+        self._upgrade_schema()
+
+    @staticmethod
+    def _set_pragmas(dbapi_connection, pragmas: dict):
+        cursor = dbapi_connection.cursor()
+        for key, value in pragmas.items():
+            cursor.execute(f'PRAGMA {key} = {value}')
+        cursor.close()
+
+    @contextmanager
+    def session_scope(self, **kwargs):
+        """
+        Provides a transactional scope. Every call opens its own session, so the scope can be used from several
+        threads at once. Commits on success and rolls back on errors.
+
+        :param kwargs: Arguments passed to the sessionmaker
+        """
+        session = self.Session(**kwargs)
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def _upgrade_schema(self):
+        """
+        Applies the pending migrations to databases that were created by earlier versions.
+        `create_all` only creates missing tables.
+        """
+        if self.engine.dialect.name == 'sqlite':
+            migrate(self.engine)
+
+        with self.engine.connect() as connection:
+            missing_paths = connection.execute(
+                select(func.count()).select_from(Collection).where(Collection.path.is_(None))
+            ).scalar()
+
+        if missing_paths:
+            self.update_collection_paths()
+
+    def explain(self, statement) -> List[str]:
+        """
+        Returns the SQLite query plan of a statement, e.g. to check which indexes are used.
+
+        :param statement: SQLAlchemy statement or SQL string
+        :return: Details of the query plan steps
+        """
+        if isinstance(statement, str):
+            statement = sql_text(statement)
+
+        compiled = statement.compile(self.engine, compile_kwargs={'literal_binds': True})
+
+        with self.engine.connect() as connection:
+            rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}').all()
+
+        return [row[-1] for row in rows]
+
+    def update_collection_paths(self):
+        """
+        Computes the materialized paths (Library/Parent/Collection) of all collections.
+        """
+        with self.session_scope() as session:
+            rows = session.query(Collection.id, Collection.name, Collection.parent_id, Library.name).outerjoin(
+                Library, Library.id == Collection.library_id
+            ).all()
+
+            collections = {collection_id: (name, parent_id, library) for collection_id, name, parent_id, library in rows}
+            paths = {}
+
+            def get_path(collection_id):
+                if collection_id not in paths:
+                    name, parent_id, library = collections[collection_id]
+                    if parent_id is None or parent_id not in collections:
+                        paths[collection_id] = os.path.join(library or '', name)
+                    else:
+                        paths[collection_id] = os.path.join(get_path(parent_id), name)
+                return paths[collection_id]
+
+            session.execute(update(Collection), [
+                {'id': collection_id, 'path': get_path(collection_id)} for collection_id in collections
+            ])
+
+    def read_collection_items(self, collection_id: int, include_text=False) -> pd.DataFrame:
+        """
+        Returns the items of a collection and all of its subcollections.
+        The subtree is resolved by a recursive CTE, so the items are loaded with a single query.
+
+        :param collection_id: ID of the collection
+        :param include_text: If True, the full texts are included.
+        :return: DataFrame indexed by the item keys
+        """
+        tree = select(Collection.id).where(Collection.id == collection_id).cte('tree', recursive=True)
+        tree = tree.union_all(select(Collection.id).where(Collection.parent_id == tree.c.id))
+
+        keys = select(item_collection_association.c.bibliography_key).where(
+            item_collection_association.c.collection_id.in_(select(tree.c.id))
+        )
+
+        return self.read_items(BibliographyItem.key.in_(keys), include_text=include_text)
+
+    def get_collection_id_by_path(self, path: str) -> int | None:
+        """
+        Returns the ID of the collection with the path. Zotero allows sibling collections with the same name,
+        in that case the collection with the lowest ID is returned.
+        """
+        with self.Session() as session:
+            return session.scalars(select(Collection.id).where(Collection.path == path).order_by(Collection.id)).first()
+
+    def compress_texts(self, batch_size: int = 500, vacuum=True) -> dict:
+        """
+        Compresses the full texts and response contexts that were stored uncompressed by earlier versions.
+        Afterwards the database file is vacuumed to release the space.
+
+        :param batch_size: Number of rows rewritten per transaction.
+        :param vacuum: If True, runs VACUUM after the migration.
+        :return: Dict with the file size before and after the migration in bytes.
+        """
+        columns = [
+            (BibliographyItem.__table__, BibliographyItem.__table__.c.key, BibliographyItem.__table__.c.text),
+            (Response.__table__, Response.__table__.c.id, Response.__table__.c.context),
+        ]
+
+        size_before = self.size
+
+        for table, primary_key, column in columns:
+            while True:
+                with self.engine.begin() as connection:
+                    rows = connection.execute(
+                        select(primary_key, type_coerce(column, String)).where(
+                            func.typeof(column) == 'text'
+                        ).limit(batch_size)
+                    ).all()
+
+                    if not rows:
+                        break
+
+                    connection.execute(
+                        update(table).where(primary_key == bindparam('pk')),
+                        [{'pk': pk, column.name: value} for pk, value in rows]
+                    )
+
+                logger.info(f'Compressed {len(rows)} rows of {table.name}.{column.name}')
+
+        if vacuum:
+            with self.engine.connect() as connection:
+                connection.execution_options(isolation_level='AUTOCOMMIT').execute(sql_text('VACUUM'))
+
+        return {'size_before': size_before, 'size_after': self.size}
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the database file in bytes.
+        """
+        with self.engine.connect() as connection:
+            page_count = connection.execute(sql_text('PRAGMA page_count')).scalar()
+            page_size = connection.execute(sql_text('PRAGMA page_size')).scalar()
+        return page_count * page_size
 
     def get_or_create_project(self, name):
         with self.Session(expire_on_commit=False) as session:
@@ -65,42 +260,150 @@ class Database:
 
             session.commit()
 
-    def get_responses_for_project(self, project_id):
+    def parse_responses(self, session: Session, query: QueryModel) -> pd.Series:
+        """
+        Returns the parsed values of all responses to a query. Values stored alongside the responses are reused,
+        responses without a value or with a value from an outdated parser are parsed in memory.
+        Use reparse_responses to store their values.
+
+        :param session: SQLAlchemy Session
+        :param query: The query whose responses are parsed.
+        :return: Series with the parsed values indexed by the item keys.
+        """
+        rows = session.query(
+            Response.item_key, Response.text, Response.parsed_value, Response.parser_version
+        ).where(Response.query_id == query.id).all()
+
+        prompt = query.prompt
+        version = prompt.parser_version
+
+        d = {}
+        for item_key, text, parsed_value, parser_version in rows:
+            if parser_version == version:
+                d[item_key] = json.loads(parsed_value)
+            else:
+                d[item_key] = prompt.parse_value(text)
+
+        return pd.Series(d, name=query.name)
+
+    def reparse_responses(self, query_ids: List[int] | None = None) -> int:
+        """
+        Parses and stores the values of all responses that were written before values were stored
+        or by an outdated parser.
+
+        :param query_ids: Optional IDs of the queries. If None, the responses of all queries are parsed.
+        :return: Number of updated responses
+        """
+        n = 0
+
+        with self.session_scope() as session:
+            queries = session.query(QueryModel)
+            if query_ids is not None:
+                queries = queries.where(QueryModel.id.in_(query_ids))
+            queries = queries.all()
+
+            for query in tqdm(queries, desc='Parsing responses', total=len(queries)):
+                prompt = query.prompt
+                version = prompt.parser_version
+
+                rows = session.query(Response.id, Response.text).where(
+                    Response.query_id == query.id,
+                    or_(Response.parser_version.is_(None), Response.parser_version != version)
+                ).all()
+
+                if rows:
+                    session.execute(update(Response), [
+                        {
+                            'id': response_id,
+                            'parsed_value': json.dumps(prompt.parse_value(text), default=str),
+                            'parser_version': version
+                        }
+                        for response_id, text in rows
+                    ])
+                    n += len(rows)
+
+        return n
+
+    def get_responses_for_project(self, project_id) -> pd.DataFrame:
+        """
+        Returns the parsed values of all responses in the project as a DataFrame
+        with one row per item and one column per query.
+        The stored values are loaded with a single statement and pivoted into the wide format.
+
+        :param project_id: ID of the project
+        :return: DataFrame indexed by the item keys
+        """
         with self.Session() as session:
             project = session.get(ProjectModel, project_id)
             queries = project.queries
 
-            # items = project.items
+            # Responses that have no stored value or one from an outdated parser are parsed in memory
+            versions = {query.id: query.prompt.parser_version for query in queries}
+            stored_versions = session.query(Response.query_id, Response.parser_version).where(
+                Response.query_id.in_(versions)
+            ).distinct().all()
+            stale = {query_id for query_id, version in stored_versions if version != versions[query_id]}
 
-            data = []
+            stale_rows = [
+                pd.DataFrame({'item_key': values.index, 'name': query.name, 'value': values.values})
+                for query in queries if query.id in stale
+                for values in [self.parse_responses(session, query)]
+            ]
 
-            for query in queries:
-                responses = query.responses
+            statement = select(Response.item_key, QueryModel.name, Response.parsed_value).join(
+                Response.query
+            ).where(QueryModel.project_id == project_id, Response.query_id.not_in(stale))
 
-                d = {}
-                for response in responses:
-                    d[response.item_key] = response.value
+            rows = pd.read_sql(statement, session.bind)
+            names = [query.name for query in queries]
 
-                data.append(pd.Series(d, name=query.name))
+        # Decode every distinct JSON value only once
+        codes, uniques = pd.factorize(rows['parsed_value'])
+        values = [json.loads(value) for value in uniques]
+        rows['value'] = [values[code] if code >= 0 else None for code in codes]
 
-            df = pd.concat(data, axis=1)
+        rows = pd.concat([rows[['item_key', 'name', 'value']]] + stale_rows, ignore_index=True)
 
-            df.index.name = 'key'
+        # Databases created before responses were unique per query and item may contain duplicates
+        rows = rows.drop_duplicates(['item_key', 'name'], keep='last')
 
-            return df
+        df = rows.pivot(index='item_key', columns='name', values='value')
+        df = df.reindex(columns=names).infer_objects()
+
+        df.columns.name = None
+        df.index.name = 'key'
+
+        return df
+
+    def get_answered_keys(self, session: Session, query_id: int) -> set:
+        """
+        Returns the keys of all items that already have a response for the given query.
+
+        :param session: SQLAlchemy Session
+        :param query_id: ID of the query
+        :return: Set of item keys
+        """
+        rows = session.query(Response.item_key).where(Response.query_id == query_id).all()
+        return {item_key for item_key, in rows}
 
     def get_responses_for_query(self, query_id):
         with self.Session() as session:
             query = session.get(QueryModel, query_id)
-            responses = query.responses
+            s = self.parse_responses(session, query)
 
-            d = {}
-            for response in responses:
-                d[response.item_key] = response.value
+        return s
 
-        s = pd.Series(d, name=query.name)
+    def get_response_models(self, query_id) -> pd.DataFrame:
+        """
+        Returns the model and the cascade tier that produced each response of the query.
+        """
+        with self.Session() as session:
+            rows = session.query(Response.item_key, Response.model, Response.tier).where(
+                Response.query_id == query_id
+            ).all()
 
-        return s
+        df = pd.DataFrame(rows, columns=['key', 'model', 'tier']).set_index('key')
+        return df
 
     def clear_responses(self, session: Session, query_id: int):
         query = session.get(QueryModel, query_id)
@@ -118,73 +421,140 @@ class Database:
         """
         Add a parsed BibTeX entry to the bibliography_items table.
 
-        :param session: SQLAlchemy Session
+        :param key: Key of the item.
         :param text: The plain full text.
         :param bibtex: Dictionary containing the BibTeX fields.
         """
+        self.add_items_by_bibtex([(key, bibtex, text)])
 
         with self.Session() as session:
-
             item = session.get(BibliographyItem, key)
 
-            if not item:
-
-                year = None
-                if 'date' in bibtex:
-                    year = extract_year(bibtex.get('date'))
-
-                # Create a new BibliographyItem instance with the parsed data
-                item = BibliographyItem(
-                    key=bibtex.get('ID'),
-                    typeName=bibtex.get('ENTRYTYPE'),
-                    DOI=bibtex.get('doi'),
-                    ISBN=bibtex.get('isbn'),
-                    title=bibtex.get('title'),
-                    year=year,
-                    abstract=bibtex.get('abstract'),
-                    series=bibtex.get('series'),
-                    journal=bibtex.get('journaltitle'),
-                    publisher=bibtex.get('publisher'),
-                    keywords=bibtex.get('keywords'),
-                    text=text
-                )
-
-                session.add(item)
-                session.commit()
-
-                author_string = bibtex.get('author')
-                authors = author_string.split(' and ')
-
-                for s in authors:
-                    try:
-                        last_name, first_name = s.split(', ')
-
-                        author = session.query(Author).where(
-                            Author.first_name == first_name,
-                            Author.last_name == last_name
-                        ).first()
-
-                        if not author:
-                            author = Author(
-                                first_name=first_name,
-                                last_name=last_name
-                            )
-                            session.add(author)
-
-                        print(author)
-
-                        author.items.append(item)
-
-                        session.commit()
-                    except Exception as e:
-                        print(e)
-                        print(f"Parsing name {s} failed.")
+        return item
 
-                session.commit()
+    @staticmethod
+    def _bibtex_to_row(key: str, bibtex: dict, text: str | None) -> dict:
+        year = None
+        if 'date' in bibtex:
+            year = extract_year(bibtex.get('date'))
+
+        return dict(
+            key=key,
+            typeName=bibtex.get('ENTRYTYPE'),
+            DOI=bibtex.get('doi'),
+            ISBN=bibtex.get('isbn'),
+            title=bibtex.get('title'),
+            year=year,
+            abstract=bibtex.get('abstract'),
+            series=bibtex.get('series'),
+            journal=bibtex.get('journaltitle'),
+            publisher=bibtex.get('publisher'),
+            keywords=bibtex.get('keywords'),
+            text=text
+        )
+
+    def add_items_by_bibtex(
+            self,
+            entries: List[tuple],
+            project_id: int | None = None,
+            batch_size: int = 500,
+            update_existing: bool = False
+    ) -> List[str]:
+        """
+        Adds many parsed BibTeX entries in a single transaction. Items that already exist are skipped.
+        All author names are resolved with one query per batch of names and missing authors, items and
+        associations are inserted in bulk.
+
+        :param entries: List of (key, bibtex, text) tuples
+        :param project_id: Optional project the new and existing items are added to.
+        :param batch_size: Number of values per IN clause.
+        :param update_existing: If True, the fields of existing items are overwritten with the values of the entries
+            that are not None. Items with a new text are marked as not synced.
+        :return: Keys of the added items
+        """
+        entries = list({key: (key, bibtex, text) for key, bibtex, text in entries}.values())
+        keys = [key for key, _, _ in entries]
+
+        with self.session_scope() as session:
+
+            existing = self.get_existing_keys(keys, batch_size, session=session)
+
+            new_entries = [entry for entry in entries if entry[0] not in existing]
+
+            item_authors = {key: get_authors_from_author_field(bibtex.get('author')) for key, bibtex, _ in new_entries}
+            names = {name for authors in item_authors.values() for name in authors}
+
+            # Resolve all names through an in-memory map of (last_name, first_name) -> id
+            author_ids = {}
+            last_names = list({last_name for last_name, _ in names})
+            for i in range(0, len(last_names), batch_size):
+                rows = session.execute(
+                    select(Author.id, Author.last_name, Author.first_name).where(
+                        Author.last_name.in_(last_names[i:i + batch_size])
+                    )
+                ).all()
+                for author_id, last_name, first_name in rows:
+                    author_ids.setdefault((last_name, first_name), author_id)
+
+            missing = [name for name in names if name not in author_ids]
+            if missing:
+                rows = session.execute(
+                    insert(Author).returning(Author.id, Author.last_name, Author.first_name, sort_by_parameter_order=True),
+                    [{'last_name': last_name, 'first_name': first_name} for last_name, first_name in missing]
+                ).all()
+                for author_id, last_name, first_name in rows:
+                    author_ids[(last_name, first_name)] = author_id
+                search_index.index_authors(session.connection(), [
+                    (author_id, first_name, last_name) for author_id, last_name, first_name in rows
+                ])
+
+            if new_entries:
+                session.execute(insert(BibliographyItem.__table__), [
+                    self._bibtex_to_row(key, bibtex, text) for key, bibtex, text in new_entries
+                ])
+
+            if update_existing:
+                # The index needs the old values to remove the items
+                search_index.delete_items(session.connection(), [key for key in keys if key in existing])
+
+                table = BibliographyItem.__table__
+                for key, bibtex, text in entries:
+                    if key not in existing:
+                        continue
+                    row = self._bibtex_to_row(key, bibtex, text)
+                    values = {column: value for column, value in row.items() if value is not None and column != 'key'}
+                    if text is not None:
+                        values['synced'] = False
+                    if values:
+                        session.execute(update(table).where(table.c.key == key).values(**values))
+
+            # Keeps the order of the authors within an entry
+            associations = dict.fromkeys(
+                (author_ids[name], key) for key, authors in item_authors.items() for name in authors
+            )
+            if associations:
+                session.execute(insert(item_author_association), [
+                    {'author_id': author_id, 'bibliography_key': key} for author_id, key in associations
+                ])
+
+            updated = [key for key in keys if key in existing] if update_existing else []
+            search_index.index_items(session.connection(), [key for key, _, _ in new_entries] + updated)
+
+            if project_id is not None:
+                in_project = set(session.scalars(
+                    select(item_project_association.c.bibliography_key).where(
+                        item_project_association.c.project_id == project_id
+                    )
+                ))
+                project_keys = [key for key in keys if key not in in_project]
+                if project_keys:
+                    session.execute(insert(item_project_association), [
+                        {'project_id': project_id, 'bibliography_key': key} for key in project_keys
+                    ])
 
-                print(f"Added BibTeX entry with key {item.key}")
+        logger.info(f'Added {len(new_entries)} BibTeX entries, {len(missing)} new authors')
 
-        return item
+        return [key for key, _, _ in new_entries]
 
     def add_item_to_project(self, item_key: str, project_id: str):
         with self.Session() as session:
@@ -282,6 +652,40 @@ class Database:
 
         return query
 
+    def add_query_dependency(self, query_id: int, depends_on_id: int, value=True):
+        """
+        Lets the query only run on items where the response to another query has the given value.
+
+        :param query_id: ID of the dependent query.
+        :param depends_on_id: ID of the query that has to be answered first.
+        :param value: Parsed value the response must be equal to. Must be JSON serializable.
+        """
+        if query_id == depends_on_id:
+            raise Exception('A query cannot depend on itself.')
+
+        with self.session_scope() as session:
+            session.merge(QueryDependency(
+                query_id=query_id,
+                depends_on_id=depends_on_id,
+                value=json.dumps(value)
+            ))
+
+    def remove_query_dependency(self, query_id: int, depends_on_id: int):
+        with self.Session() as session:
+            dependency = session.get(QueryDependency, (query_id, depends_on_id))
+            if dependency:
+                session.delete(dependency)
+                session.commit()
+                return True
+        return False
+
+    def get_query_dependencies(self, session: Session, query_id: int) -> dict:
+        """
+        Returns a dict mapping the IDs of the queries the given query depends on to the required values.
+        """
+        dependencies = session.query(QueryDependency).where(QueryDependency.query_id == query_id).all()
+        return {dependency.depends_on_id: dependency.load_value() for dependency in dependencies}
+
     def get_or_create_author_by_name(self, first_name, last_name):
         session = self.session
         author = session.query(Author).where(Author.first_name == first_name, Author.last_name == last_name).first()
@@ -302,16 +706,34 @@ class Database:
         items = session.query(BibliographyItem).where(BibliographyItem.authors.contains(author)).all()
         return items
 
-    def search_author(self, session, search_name):
-        authors = session.query(Author).filter(
-            or_(
-                Author.first_name.ilike(f"%{search_name}%"),
-                Author.last_name.ilike(f"%{search_name}%"),
-                Author.full_name.ilike(f"%{search_name}%")
-            )
-        ).all()
-
-        return authors
+    def search_author(self, session, search_name, n: int | None = None, fuzzy: bool = False) -> List[Author]:
+        """
+        Returns the authors matching a name ordered by relevance. See search_authors.
+        """
+        ids = search_index.search_authors(session.connection(), search_name, n=n, fuzzy=fuzzy).index.tolist()
+        authors = {author.id: author for author in session.query(Author).where(Author.id.in_(ids)).all()}
+
+        return [authors[author_id] for author_id in ids]
+
+    def search_authors(
+            self,
+            search_name: str,
+            n: int | None = 20,
+            fuzzy: bool = False,
+            threshold: float = 0.5
+    ) -> pd.DataFrame:
+        """
+        Searches authors with the trigram name index. Names are compared case and accent insensitive and
+        the words of the query may be given in any order and may be incomplete, e.g. `lovel ada` finds `Ada Lovelace`.
+
+        :param search_name: Name or part of a name
+        :param n: Maximum number of authors. If None, all matching authors are returned.
+        :param fuzzy: If True, names with typos are found as well.
+        :param threshold: Minimum share of the query trigrams a name must contain in a fuzzy search.
+        :return: DataFrame indexed by the author ids with the columns first_name, last_name and score.
+        """
+        with self.engine.connect() as connection:
+            return search_index.search_authors(connection, search_name, n=n, fuzzy=fuzzy, threshold=threshold)
 
     def add_response(self, query, item, text):
         response = Response(query=query, item=item)
@@ -332,12 +754,184 @@ class Database:
 
     @property
     def items(self):
-        with self.Session() as session:
-            items = session.query(BibliographyItem).all()
+        return self.get_items()
+
+    def get_items(self, include_text=False) -> pd.DataFrame:
+        """
+        Returns all items in the database as a DataFrame.
+
+        :param include_text: If True, the full texts are included.
+        :return:
+        """
+        return self.read_items(include_text=include_text)
+
+    def read_items(self, where=None, include_text=False) -> pd.DataFrame:
+        """
+        Reads items into a DataFrame with a single SELECT statement without creating ORM objects.
+        The authors are aggregated in SQL and the library is joined by name.
+        Collections and tags can be fetched on demand with get_item_collections and get_item_tags.
+
+        :param where: Optional SQLAlchemy expression to filter the items.
+        :param include_text: If True, the full texts are included.
+        :return: DataFrame indexed by the item keys
+        """
+        columns = [column for column in BibliographyItem.__table__.columns if include_text or column.name != 'text']
+
+        author_name = func.coalesce(Author.last_name, '') + ', ' + func.coalesce(Author.first_name, '')
+        authors = select(
+            item_author_association.c.bibliography_key,
+            func.group_concat(author_name, AUTHOR_SEPARATOR).label('authors')
+        ).join(
+            Author, Author.id == item_author_association.c.author_id
+        ).group_by(item_author_association.c.bibliography_key).subquery()
+
+        statement = select(
+            *columns,
+            authors.c.authors,
+            Library.name.label('library')
+        ).outerjoin(
+            authors, authors.c.bibliography_key == BibliographyItem.key
+        ).outerjoin(
+            Library, Library.id == BibliographyItem.library_id
+        )
+
+        if where is not None:
+            statement = statement.where(where)
+
+        with self.engine.connect() as connection:
+            df = pd.read_sql(statement, connection, parse_dates=['time_created', 'time_updated'])
+
+        df['authors'] = [value.split(AUTHOR_SEPARATOR) if isinstance(value, str) else [] for value in df['authors']]
+        df['synced'] = df['synced'].astype('boolean')
+
+        df = df.set_index('key')
 
-        df = BibliographyItem.to_df(items)
         return df
 
+    def _read_item_associations(self, association, id_column, model, item_keys) -> pd.Series:
+        statement = select(association.c.bibliography_key, model.name).join(
+            model, model.id == id_column
+        ).where(association.c.bibliography_key.in_(list(item_keys)))
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(statement).all()
+
+        d = {key: [] for key in item_keys}
+        for key, name in rows:
+            d[key].append(name)
+
+        return pd.Series(d, dtype=object)
+
+    def get_item_collections(self, item_keys: List[str]) -> pd.Series:
+        """
+        Returns the names of the collections of each item.
+        """
+        return self._read_item_associations(
+            item_collection_association, item_collection_association.c.collection_id, Collection, item_keys
+        ).rename('collections')
+
+    def get_item_tags(self, item_keys: List[str]) -> pd.Series:
+        """
+        Returns the tags of each item.
+        """
+        return self._read_item_associations(
+            item_tag_association, item_tag_association.c.tag_id, Tag, item_keys
+        ).rename('tags')
+
+    def get_texts(self, item_keys: List[str], batch_size: int = 500) -> pd.Series:
+        """
+        Returns the full texts of the given items. The texts are fetched in batches of keys.
+
+        :param item_keys: Keys of the items
+        :param batch_size: Number of keys per SELECT statement
+        :return: Series with the texts indexed by the item keys
+        """
+        item_keys = list(item_keys)
+        d = {}
+
+        with self.Session() as session:
+            for i in range(0, len(item_keys), batch_size):
+                batch = item_keys[i:i + batch_size]
+                rows = session.query(BibliographyItem.key, BibliographyItem.text).where(
+                    BibliographyItem.key.in_(batch)
+                ).all()
+                d.update(rows)
+
+        s = pd.Series(d, name='text', dtype=object).reindex(item_keys)
+        s.index.name = 'key'
+        return s
+
+    def keyword_search(
+            self,
+            query: str,
+            n: int | None = 10,
+            keys: List[str] | None = None,
+            raw: bool = False,
+            snippet_tokens: int = 16,
+            snippets: bool = True
+    ) -> pd.DataFrame:
+        """
+        Searches the titles, abstracts, keywords and full texts with the FTS5 keyword index.
+
+        :param query: Search terms. All terms have to match. If raw is True, the query is passed as FTS5 query
+            and may use operators like OR, NEAR and prefixes (e.g. `"language model" OR llm*`).
+        :param n: Maximum number of items. If None, all matching items are returned.
+        :param keys: Optional keys of the items to search within.
+        :param raw: If True, the query is not quoted.
+        :param snippet_tokens: Number of tokens of the snippets.
+        :param snippets: If False, the snippet column is empty, which avoids loading the texts of the items.
+        :return: DataFrame indexed by the item keys with the columns score and snippet, ordered by the bm25 score.
+        """
+        with self.engine.connect() as connection:
+            return search_index.keyword_search(connection, query, n, keys, raw, snippet_tokens, snippets)
+
+    def rebuild_search_index(self):
+        """
+        Rebuilds the keyword index from scratch, e.g. after items were changed with raw SQL.
+        """
+        with self.engine.begin() as connection:
+            search_index.rebuild_search_index(connection)
+
+    def get_existing_keys(self, item_keys: List[str], batch_size: int = 500, session: Session | None = None) -> set:
+        """
+        Returns the subset of the given keys that are already stored.
+
+        :param item_keys: Keys of the items
+        :param batch_size: Number of keys per SELECT statement
+        :param session: Optional session to run the queries in.
+        """
+        if session is None:
+            with self.Session() as session:
+                return self.get_existing_keys(item_keys, batch_size, session)
+
+        item_keys = list(item_keys)
+        existing = set()
+
+        for i in range(0, len(item_keys), batch_size):
+            existing.update(session.scalars(
+                select(BibliographyItem.key).where(BibliographyItem.key.in_(item_keys[i:i + batch_size]))
+            ))
+
+        return existing
+
+    def set_synced(self, item_keys: List[str], synced: bool = True, batch_size: int = 500):
+        """
+        Marks items as synced with the vector store.
+
+        :param item_keys: Keys of the items
+        :param synced: New value of the flag
+        :param batch_size: Number of keys per UPDATE statement
+        """
+        item_keys = list(item_keys)
+
+        with self.engine.begin() as connection:
+            for i in range(0, len(item_keys), batch_size):
+                connection.execute(
+                    update(BibliographyItem.__table__).where(
+                        BibliographyItem.__table__.c.key.in_(item_keys[i:i + batch_size])
+                    ).values(synced=synced)
+                )
+
     @property
     def collections(self):
         session = Session(self.engine)
@@ -393,6 +987,7 @@ class Database:
                     parent_id=row['parentCollectionID'],
                 ))
             session.commit()
+            self.update_collection_paths()
 
             # Authors
             for author_id, row in zotero.authors.iterrows():
@@ -0,0 +1,170 @@
+"""
+Versioned schema migrations for existing database files.
+
+`create_all` only creates missing tables. Changes to existing tables are applied by the migrations below.
+The version of a database is stored in `PRAGMA user_version` and every migration with a higher version is applied
+in order when the database is opened. Migrations must be idempotent, since databases created by earlier versions
+may already contain some of the changes.
+
+To change the schema, update the models and register a new migration with the next version number.
+"""
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text as sql_text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+from .models import Base
+from .search_index import (
+    create_search_index, drop_search_index, rebuild_search_index, create_author_index, rebuild_author_index
+)
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+# Table holding the responses removed by the deduplication
+DUPLICATES_TABLE = 'responses_duplicates'
+
+
+def migration(version: int, description: str):
+    """
+    Registers a function as migration. The function receives a connection with an open transaction.
+
+    :param version: Schema version after the migration was applied.
+    :param description: Short description that is logged.
+    """
+
+    def decorator(func):
+        if any(version == v for v, _, _ in MIGRATIONS):
+            raise Exception(f'Migration {version} is already registered.')
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+
+    return decorator
+
+
+def get_latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def get_schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def set_schema_version(connection: Connection, version: int):
+    connection.exec_driver_sql(f'PRAGMA user_version = {int(version)}')
+
+
+def add_missing_columns(connection: Connection):
+    """
+    Adds all columns of the models that are missing in the existing tables.
+    """
+    inspector = inspect(connection)
+
+    for table in Base.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.execute(sql_text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f'Added column {column.name} to table {table.name}')
+
+
+def create_missing_indexes(connection: Connection):
+    """
+    Creates all indexes of the models that are missing.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+@migration(1, 'Add columns for stored contexts, parsed values and collection paths')
+def _add_columns(connection: Connection):
+    add_missing_columns(connection)
+
+
+@migration(2, 'Remove duplicate responses')
+def _deduplicate_responses(connection: Connection):
+    # Keeps the latest response of every query and item, so that the unique index can be created.
+    # The older responses are moved to a backup table instead of being dropped.
+    duplicates = 'SELECT * FROM responses WHERE id NOT IN (SELECT max(id) FROM responses GROUP BY query_id, item_key)'
+
+    n = connection.execute(sql_text(f'SELECT count(*) FROM ({duplicates})')).scalar()
+    if n == 0:
+        return
+
+    connection.execute(sql_text(f'CREATE TABLE IF NOT EXISTS {DUPLICATES_TABLE} AS {duplicates} LIMIT 0'))
+    connection.execute(sql_text(f'INSERT INTO {DUPLICATES_TABLE} {duplicates}'))
+    connection.execute(sql_text(f'DELETE FROM responses WHERE id IN (SELECT id FROM {DUPLICATES_TABLE})'))
+
+    logger.warning(
+        f'Moved {n} duplicate responses to the table {DUPLICATES_TABLE}, the latest response of every query and '
+        f'item is kept'
+    )
+
+
+@migration(3, 'Add indexes for responses, associations, authors and DOIs')
+def _create_indexes(connection: Connection):
+    create_missing_indexes(connection)
+
+
+@migration(4, 'Add keyword search index')
+def _create_search_index(connection: Connection):
+    # Filled by migration 7
+    pass
+
+
+@migration(5, 'Add author name index')
+def _create_author_index(connection: Connection):
+    create_author_index(connection)
+    rebuild_author_index(connection)
+
+
+@migration(6, 'Key the keyword search index by the rowids of the items')
+def _rebuild_search_index(connection: Connection):
+    # Superseded by migration 7
+    pass
+
+
+@migration(7, 'Make the keyword search index contentless')
+def _recreate_search_index(connection: Connection):
+    drop_search_index(connection)
+    create_search_index(connection)
+    rebuild_search_index(connection)
+
+
+def migrate(engine: Engine) -> List[int]:
+    """
+    Applies all pending migrations. Databases created by `create_all` start at version 0 as well,
+    all migrations are cheap on empty tables.
+
+    :param engine: SQLAlchemy engine of a SQLite database.
+    :return: Versions of the applied migrations
+    """
+    with engine.connect() as connection:
+        version = get_schema_version(connection)
+
+    applied = []
+
+    for target, description, func in MIGRATIONS:
+        if target <= version:
+            continue
+
+        logger.info(f'Migrating database to version {target}: {description}')
+
+        try:
+            with engine.begin() as connection:
+                func(connection)
+                set_schema_version(connection, target)
+        except IntegrityError as e:
+            logger.warning(f'Migration {target} failed, the database stays at version {version}: {e}')
+            break
+
+        version = target
+        applied.append(target)
+
+    return applied
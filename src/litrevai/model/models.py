@@ -1,16 +1,18 @@
 import json
 import os.path
 import re
+import zlib
 from enum import Enum
 from typing import Literal
 
 import pandas as pd
-from sqlalchemy import Column, String, Integer, ForeignKey, Table, DateTime, UniqueConstraint, literal, Boolean
+from sqlalchemy import Column, String, Integer, ForeignKey, Table, DateTime, UniqueConstraint, literal, Boolean, Index, \
+    LargeBinary, TypeDecorator, event, inspect, select, update
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import DeclarativeBase, relationship, mapped_column, Session
 from sqlalchemy.sql import func
 
-from litrevai.prompt import prompt_registry
+from litrevai.prompt import prompt_registry, load_prompt
 
 
 class EntryTypes(Enum):
@@ -40,6 +42,27 @@ zotero_to_entrytype = {
 }
 
 
+class CompressedText(TypeDecorator):
+    """
+    Text column that is transparently stored zlib compressed.
+    Uncompressed strings written by earlier versions are returned unchanged.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    compression_level = 6
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return zlib.compress(value.encode('utf-8'), self.compression_level)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return zlib.decompress(value).decode('utf-8')
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -47,25 +70,25 @@ class Base(DeclarativeBase):
 item_author_association = Table(
     'item_author', Base.metadata,
     Column('author_id', Integer, ForeignKey('authors.id'), primary_key=True),
-    Column('bibliography_key', Integer, ForeignKey('bibliography_items.key'), primary_key=True)
+    Column('bibliography_key', Integer, ForeignKey('bibliography_items.key'), primary_key=True, index=True)
 )
 
 item_collection_association = Table(
     'item_collection', Base.metadata,
     Column('collection_id', Integer, ForeignKey('collections.id'), primary_key=True),
-    Column('bibliography_key', Integer, ForeignKey('bibliography_items.key'), primary_key=True)
+    Column('bibliography_key', Integer, ForeignKey('bibliography_items.key'), primary_key=True, index=True)
 )
 
 item_tag_association = Table(
     'item_tag', Base.metadata,
     Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
-    Column('bibliography_key', Integer, ForeignKey('bibliography_items.key'), primary_key=True)
+    Column('bibliography_key', Integer, ForeignKey('bibliography_items.key'), primary_key=True, index=True)
 )
 
 item_project_association = Table(
     'item_project', Base.metadata,
     Column('project_id', Integer, ForeignKey('projects.id'), primary_key=True),
-    Column('bibliography_key', Integer, ForeignKey('bibliography_items.key'), primary_key=True)
+    Column('bibliography_key', Integer, ForeignKey('bibliography_items.key'), primary_key=True, index=True)
 )
 
 
@@ -79,6 +102,10 @@ class Author(Base):
 
     items = relationship("BibliographyItem", secondary=item_author_association, back_populates="authors")
 
+    __table_args__ = (
+        Index('ix_authors_name', 'last_name', 'first_name'),
+    )
+
     @classmethod
     def to_df(cls, items):
         columns = [column.name for column in cls.__table__.columns]
@@ -106,7 +133,7 @@ class BibliographyItem(Base):
     key = mapped_column(String, nullable=False, primary_key=True)
     zotero_key = mapped_column(String, nullable=True, unique=True)
     typeName = mapped_column(String, nullable=True)
-    DOI = mapped_column(String, nullable=True)
+    DOI = mapped_column(String, nullable=True, index=True)
     ISBN = mapped_column(String, nullable=True)
     title = mapped_column(String, nullable=True)
     date = mapped_column(String, nullable=True)
@@ -119,7 +146,8 @@ class BibliographyItem(Base):
 
     path = mapped_column(String, nullable=True)
     abstract = mapped_column(String, nullable=True)
-    text = mapped_column(String, nullable=True)
+    # The full text is only loaded when it is accessed or explicitly requested
+    text = mapped_column(CompressedText, nullable=True, deferred=True)
     library_id = mapped_column(Integer, ForeignKey('libraries.id'))
     time_created = mapped_column(DateTime(timezone=True), server_default=func.now())
     time_updated = mapped_column(DateTime(timezone=True), onupdate=func.now())
@@ -147,8 +175,17 @@ class BibliographyItem(Base):
         return f"zotero://select/items/{self.key}"
 
     @classmethod
-    def to_df(cls, items):
+    def to_df(cls, items, include_text=False):
+        """
+        Converts items to a DataFrame indexed by their keys.
+
+        :param items: BibliographyItems
+        :param include_text: If True, the full text is included. The items must have been loaded with the text.
+        :return:
+        """
         columns = [column.name for column in cls.__table__.columns]
+        if not include_text:
+            columns.remove('text')
         columns.extend([
             'authors_list',
             'library'
@@ -190,6 +227,10 @@ class QueryModel(Base):
     # Relationship back to Response
     responses = relationship("Response", back_populates="query")
     project = relationship('ProjectModel', back_populates='queries')
+    dependencies = relationship('QueryDependency', foreign_keys='QueryDependency.query_id',
+                                back_populates='query', cascade='all, delete-orphan')
+    dependents = relationship('QueryDependency', foreign_keys='QueryDependency.depends_on_id',
+                              back_populates='depends_on', cascade='all, delete-orphan')
 
     __table_args__ = (
         UniqueConstraint('name', 'project_id', name='_name_project_uc'),
@@ -200,22 +241,49 @@ class QueryModel(Base):
 
     @property
     def prompt(self):
-        params = self.load_params()
-        return prompt_registry[self.type](question=self.question, **params)
+        return load_prompt(self.type, self.question, self.params)
 
     def load_params(self):
         params = json.loads(self.params)
         return params
 
 
+class QueryDependency(Base):
+    """
+    A query only runs on items where the response to the query it depends on has the given (parsed) value.
+    """
+    __tablename__ = 'query_dependencies'
+
+    query_id = mapped_column(Integer, ForeignKey('queries.id'), primary_key=True)
+    depends_on_id = mapped_column(Integer, ForeignKey('queries.id'), primary_key=True)
+    value = mapped_column(String, default='true')
+
+    query = relationship('QueryModel', foreign_keys=[query_id], back_populates='dependencies')
+    depends_on = relationship('QueryModel', foreign_keys=[depends_on_id], back_populates='dependents')
+
+    def __repr__(self):
+        return f"<QueryDependency(query_id={self.query_id}, depends_on_id={self.depends_on_id}, value={self.value})>"
+
+    def load_value(self):
+        return json.loads(self.value)
+
+
 class Response(Base):
     __tablename__ = 'responses'
 
     id = mapped_column(Integer, primary_key=True, autoincrement=True)
     text = mapped_column(String, nullable=False)
     query_id = mapped_column(Integer, ForeignKey('queries.id'))
-    item_key = mapped_column(String, ForeignKey('bibliography_items.key'))
-    context = mapped_column(String, nullable=True)
+    item_key = mapped_column(String, ForeignKey('bibliography_items.key'), index=True)
+    context = mapped_column(CompressedText, nullable=True)
+    # JSON list of the retrieved chunks as (key, chunk, distance)
+    chunks = mapped_column(String, nullable=True)
+    model = mapped_column(String, nullable=True)
+    tier = mapped_column(Integer, nullable=True)
+
+    # JSON encoded result of Prompt.parse_value and the version of the parser that produced it
+    parsed_value = mapped_column(String, nullable=True)
+    parser_version = mapped_column(Integer, nullable=True)
     time_created = mapped_column(DateTime(timezone=True), server_default=func.now())
     time_updated = mapped_column(DateTime(timezone=True), onupdate=func.now())
 
@@ -223,6 +291,10 @@ class Response(Base):
     item = relationship("BibliographyItem", back_populates="responses")
     query = relationship("QueryModel", back_populates="responses")
 
+    __table_args__ = (
+        Index('ix_responses_query_item', 'query_id', 'item_key', unique=True),
+    )
+
     def __repr__(self):
         return f"<Response(id={self.id}, value={self.value}, text={self.text}, key='{self.item.key}', query_id={self.query.id})>"
 
@@ -240,9 +312,20 @@ class Response(Base):
         }, name=self.id)
         return s
 
+    def set_value(self, prompt):
+        """
+        Parses the text with the prompt and stores the value alongside the response.
+        """
+        self.parsed_value = json.dumps(prompt.parse_value(self.text), default=str)
+        self.parser_version = prompt.parser_version
+
     @property
     def value(self):
         prompt = self.query.prompt
+
+        if self.parser_version == prompt.parser_version:
+            return json.loads(self.parsed_value)
+
         value = prompt.parse_value(self.text)
         return value
 
@@ -299,6 +382,9 @@ class Collection(Base):
     name = mapped_column(String, nullable=False)
     parent_id = mapped_column(Integer, ForeignKey('collections.id'), nullable=True)
     library_id = mapped_column(Integer, ForeignKey('libraries.id'), nullable=True)
+    # Materialized path (Library/Parent/Collection), maintained by the mapper events below
+    # and recomputed for all collections by Database.update_collection_paths
+    path = mapped_column(String, nullable=True, index=True)
 
     # Relationships
     items = relationship('BibliographyItem', secondary=item_collection_association, back_populates="collections")
@@ -310,19 +396,69 @@ class Collection(Base):
         return f"Collection(id={self.id}, name='{self.name}')"
 
     def get_items(self):
-        items = self.items
-
-        if self.children is not None:
-            for child in self.children:
-                items.extend(child.get_items())
+        """
+        Returns the items of the collection and all of its subcollections.
+        Use Database.read_collection_items to load them with a single query.
+        """
+        items = list(self.items)
+
+        for child in self.children:
+            items.extend(child.get_items())
         return items
 
-    @property
-    def path(self):
-        if self.parent_id is None:
-            return os.path.join(self.library.name, self.name)
-        else:
-            return os.path.join(self.parent.path, self.name)
+
+def _update_descendant_paths(connection, collection_id: int, path: str):
+    table = Collection.__table__
+    children = connection.execute(select(table.c.id, table.c.name).where(table.c.parent_id == collection_id)).all()
+    for child_id, name in children:
+        child_path = os.path.join(path, name)
+        connection.execute(update(table).where(table.c.id == child_id).values(path=child_path))
+        _update_descendant_paths(connection, child_id, child_path)
+
+
+@event.listens_for(Collection, 'before_insert')
+@event.listens_for(Collection, 'before_update')
+def _set_collection_path(mapper, connection, target):
+    state = inspect(target)
+    if state.persistent and not any(
+            state.attrs[attr].history.has_changes() for attr in ['name', 'parent_id', 'library_id', 'parent']
+    ):
+        return
+
+    # Parents and libraries are inserted before their collections, so their rows are already written
+    parent_path = None
+    if target.parent_id is not None:
+        parent_path = connection.execute(
+            select(Collection.__table__.c.path).where(Collection.__table__.c.id == target.parent_id)
+        ).scalar()
+
+    if parent_path is None:
+        parent_path = connection.execute(
+            select(Library.__table__.c.name).where(Library.__table__.c.id == target.library_id)
+        ).scalar() or ''
+
+    target.path = os.path.join(parent_path, target.name)
+
+
+@event.listens_for(Collection, 'after_update')
+def _update_collection_descendants(mapper, connection, target):
+    if inspect(target).attrs.path.history.has_changes():
+        _update_descendant_paths(connection, target.id, target.path)
+
+
+@event.listens_for(Library, 'after_update')
+def _update_library_collection_paths(mapper, connection, target):
+    if not inspect(target).attrs.name.history.has_changes():
+        return
+
+    table = Collection.__table__
+    roots = connection.execute(
+        select(table.c.id, table.c.name).where(table.c.library_id == target.id, table.c.parent_id.is_(None))
+    ).all()
+    for collection_id, name in roots:
+        path = os.path.join(target.name, name)
+        connection.execute(update(table).where(table.c.id == collection_id).values(path=path))
+        _update_descendant_paths(connection, collection_id, path)
 
 
 class Tag(Base):
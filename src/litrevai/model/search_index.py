@@ -0,0 +1,453 @@
+"""
+SQLite FTS5 indexes for keyword search over the bibliography items and for author name search.
+
+The full texts are stored compressed and the author names are normalized in Python, so the indexes cannot be filled
+by SQL triggers. Instead, they are updated from Python: ORM inserts and updates are collected by mapper events and
+indexed once per flush, deletes are tracked by mapper events and bulk writes call `index_items` and `index_authors`
+explicitly.
+
+The item index is contentless, so the texts are not stored a second time uncompressed. Its rows are mapped to the
+item keys by the table items_fts_keys. Removing a row from a contentless index requires the indexed values, so items
+have to be removed with `delete_items` before their indexed values change. Snippets are built in Python from the
+texts of the best matching items.
+
+The rows of the author index share the rowids of the authors, so that rows are looked up by rowid instead of
+scanning the index.
+"""
+import json
+import logging
+import os
+import re
+import unicodedata
+from typing import List
+
+import pandas as pd
+from sqlalchemy import Column, Integer, MetaData, String, Table, delete, event, inspect, select, text as sql_text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, object_session
+
+from .models import Author, BibliographyItem
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'items_fts'
+FTS_KEYS_TABLE = 'items_fts_keys'
+AUTHORS_FTS_TABLE = 'authors_fts'
+FTS_COLUMNS = ['title', 'abstract', 'keywords', 'text']
+
+# bm25 weights of the columns title, abstract, keywords and text
+FTS_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+
+# Key of the session info holding the keys of the items to index after the flush
+PENDING_KEYS = 'search_index_keys'
+
+# Index rowids of the items with the given keys
+ITEM_ROWIDS = f'SELECT id FROM {FTS_KEYS_TABLE} WHERE key IN (SELECT value FROM json_each(:keys))'
+
+# FTS5 query operators, which are not highlighted in snippets
+FTS_OPERATORS = {'AND', 'OR', 'NOT', 'NEAR'}
+
+# Not part of the models, the table is created and migrated together with the index
+fts_keys = Table(
+    FTS_KEYS_TABLE,
+    MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('key', String, nullable=False, unique=True),
+)
+
+
+def create_search_index(connection: Connection):
+    fts_keys.create(connection, checkfirst=True)
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{', '.join(FTS_COLUMNS)}, content='', tokenize='porter unicode61')"
+    )
+
+
+def drop_search_index(connection: Connection):
+    connection.exec_driver_sql(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    connection.exec_driver_sql(f'DROP TABLE IF EXISTS {FTS_KEYS_TABLE}')
+
+
+def _indexed_values(connection: Connection, keys: List[str]) -> list:
+    # The column types of the items decompress the texts
+    table = BibliographyItem.__table__
+    return connection.execute(
+        select(fts_keys.c.id, table.c.key, *[table.c[column] for column in FTS_COLUMNS])
+        .join(table, table.c.key == fts_keys.c.key)
+        .where(fts_keys.c.key.in_(keys))
+    ).all()
+
+
+def delete_items(connection: Connection, keys: List[str], batch_size: int = 500):
+    """
+    Removes items from the index. Must be called while the items still have their indexed values,
+    i.e. before they are updated or deleted.
+    """
+    keys = list(keys)
+
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i:i + batch_size]
+        rows = _indexed_values(connection, batch)
+
+        if rows:
+            connection.execute(
+                sql_text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {', '.join(FTS_COLUMNS)}) "
+                         f"VALUES ('delete', :id, {', '.join(':' + column for column in FTS_COLUMNS)})"),
+                [dict(zip(['id', 'key'] + FTS_COLUMNS, row)) for row in rows]
+            )
+
+        connection.execute(delete(fts_keys).where(fts_keys.c.key.in_(batch)))
+
+
+def index_items(connection: Connection, keys: List[str], batch_size: int = 500):
+    """
+    Indexes the given items with their current values. Items that are already indexed are removed first,
+    which requires that their indexed values did not change since, see delete_items.
+
+    :param connection: Connection with an open transaction
+    :param keys: Keys of the items
+    :param batch_size: Number of items loaded at once.
+    """
+    keys = list(keys)
+    table = BibliographyItem.__table__
+
+    for i in range(0, len(keys), batch_size):
+        batch = keys[i:i + batch_size]
+        delete_items(connection, batch)
+
+        rows = connection.execute(
+            select(table.c.key, *[table.c[column] for column in FTS_COLUMNS]).where(table.c.key.in_(batch))
+        ).all()
+
+        if not rows:
+            continue
+
+        ids = connection.execute(
+            fts_keys.insert().returning(fts_keys.c.id, sort_by_parameter_order=True),
+            [{'key': row[0]} for row in rows]
+        ).scalars().all()
+
+        connection.execute(
+            sql_text(f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(FTS_COLUMNS)}) "
+                     f"VALUES (:id, {', '.join(':' + column for column in FTS_COLUMNS)})"),
+            [dict(zip(['id'] + FTS_COLUMNS, (row_id, *row[1:]))) for row_id, row in zip(ids, rows)]
+        )
+
+
+def rebuild_search_index(connection: Connection, batch_size: int = 500):
+    """
+    Indexes all items.
+    """
+    connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('delete-all')")
+    connection.execute(delete(fts_keys))
+    keys = connection.execute(select(BibliographyItem.__table__.c.key)).scalars().all()
+    index_items(connection, keys, batch_size)
+    logger.info(f'Indexed {len(keys)} items for keyword search')
+
+
+def to_match_expression(query: str) -> str:
+    """
+    Quotes every term of a query, so that arbitrary user input is matched as a conjunction of terms
+    instead of being parsed as FTS5 query syntax.
+    """
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+def query_terms(query: str, raw: bool = False) -> List[str]:
+    """
+    Returns the lower case words of a query that are highlighted in snippets.
+    """
+    words = re.findall(r'\w+', query)
+    if raw:
+        words = [word for word in words if word not in FTS_OPERATORS]
+    return list(dict.fromkeys(word.lower() for word in words))
+
+
+def _matches(token: str, term: str) -> bool:
+    # Approximates the porter stemmer of the index, e.g. `models` matches `modelling`
+    prefix = len(os.path.commonprefix([token, term]))
+    return prefix == len(term) or prefix >= max(4, min(len(token), len(term)) - 3)
+
+
+def make_snippet(text: str | None, terms: List[str], n_tokens: int = 16) -> tuple:
+    """
+    Returns the passage of the text with the most matching tokens. Matches are enclosed in brackets.
+
+    :param text: Text of one column
+    :param terms: Lower case terms, see query_terms
+    :param n_tokens: Number of tokens of the passage
+    :return: Tuple with the number of matches in the passage and the passage, which is None if nothing matches.
+    """
+    if not text:
+        return 0, None
+
+    tokens = list(re.finditer(r'\w+', text))
+    matches = [i for i, token in enumerate(tokens) if any(_matches(token.group().lower(), term) for term in terms)]
+
+    if not matches:
+        return 0, None
+
+    # The passage starts a few tokens before one of the matches
+    best_start, best_count = 0, 0
+    for match in matches:
+        start = max(0, min(match - n_tokens // 4, len(tokens) - n_tokens))
+        count = sum(start <= i < start + n_tokens for i in matches)
+        if count > best_count:
+            best_start, best_count = start, count
+
+    end = min(best_start + n_tokens, len(tokens))
+    matched = set(matches)
+
+    parts = []
+    position = tokens[best_start].start()
+    for i in range(best_start, end):
+        token = tokens[i]
+        parts.append(text[position:token.start()])
+        parts.append(f'[{token.group()}]' if i in matched else token.group())
+        position = token.end()
+
+    snippet = ''.join(parts)
+    if best_start > 0:
+        snippet = '...' + snippet
+    if end < len(tokens):
+        snippet += '...'
+
+    return best_count, snippet
+
+
+def keyword_search(
+        connection: Connection,
+        query: str,
+        n: int | None = 10,
+        keys: List[str] | None = None,
+        raw: bool = False,
+        snippet_tokens: int = 16,
+        snippets: bool = True
+) -> pd.DataFrame:
+    """
+    Searches the index and returns the best matching items ranked by bm25.
+
+    :param connection: Database connection
+    :param query: Search terms. If raw is True, the query is passed as FTS5 query (e.g. `"large language" OR llm*`).
+    :param n: Maximum number of items. If None, all matching items are returned.
+    :param keys: Optional keys of the items to search within.
+    :param raw: If True, the query is not quoted.
+    :param snippet_tokens: Number of tokens of the snippets.
+    :param snippets: If False, no snippets are built and the texts of the items are not loaded.
+    :return: DataFrame indexed by the item keys with the columns score and snippet.
+    """
+    match = query if raw else to_match_expression(query)
+
+    sql = (
+        f"SELECT k.key, -bm25({FTS_TABLE}, {', '.join(str(w) for w in FTS_WEIGHTS)}) AS score "
+        f"FROM {FTS_TABLE} JOIN {FTS_KEYS_TABLE} k ON k.id = {FTS_TABLE}.rowid WHERE {FTS_TABLE} MATCH :match"
+    )
+    params = {'match': match}
+
+    if keys is not None:
+        sql += f' AND {FTS_TABLE}.rowid IN ({ITEM_ROWIDS})'
+        params['keys'] = json.dumps(list(keys))
+
+    sql += ' ORDER BY score DESC'
+
+    if n is not None:
+        sql += ' LIMIT :n'
+        params['n'] = n
+
+    df = pd.DataFrame(connection.execute(sql_text(sql), params).all(), columns=['key', 'score'])
+    df['snippet'] = None
+
+    if snippets and len(df) > 0:
+        terms = query_terms(query, raw)
+        values = {row[1]: row[2:] for row in _indexed_values(connection, df['key'].tolist())}
+
+        def best_snippet(key):
+            # The column with the most matches, earlier columns win ties
+            candidates = [make_snippet(value, terms, snippet_tokens) for value in values.get(key, [])]
+            count, snippet = max(candidates, key=lambda c: c[0], default=(0, None))
+            return snippet
+
+        df['snippet'] = [best_snippet(key) for key in df['key']]
+
+    return df.set_index('key')
+
+
+def _add_pending_item(connection, target):
+    session = object_session(target)
+    if connection.dialect.name == 'sqlite' and session is not None:
+        session.info.setdefault(PENDING_KEYS, set()).add(target.key)
+
+
+@event.listens_for(BibliographyItem, 'after_insert')
+def _index_inserted_item(mapper, connection, target):
+    _add_pending_item(connection, target)
+
+
+@event.listens_for(BibliographyItem, 'before_update')
+def _remove_updated_item(mapper, connection, target):
+    state = inspect(target)
+    if connection.dialect.name == 'sqlite' and any(
+            state.attrs[column].history.has_changes() for column in FTS_COLUMNS
+    ):
+        # The row still holds the indexed values
+        delete_items(connection, [target.key])
+        _add_pending_item(connection, target)
+
+
+@event.listens_for(Session, 'after_flush')
+def _index_flushed_items(session, flush_context):
+    keys = session.info.pop(PENDING_KEYS, None)
+    if keys:
+        index_items(session.connection(), keys)
+
+
+@event.listens_for(BibliographyItem, 'before_delete')
+def _remove_deleted_item(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        delete_items(connection, [target.key])
+
+
+def normalize_name(name: str | None) -> str:
+    """
+    Folds case and accents and removes punctuation, e.g. `Müller-Lüdenscheidt, J.` becomes `muller ludenscheidt j`.
+    """
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).casefold()
+    return ' '.join(re.sub(r'[^\w]+', ' ', name).split())
+
+
+def trigrams(name: str) -> set:
+    return {word[i:i + 3] for word in name.split() for i in range(max(len(word) - 2, 1))}
+
+
+def create_author_index(connection: Connection):
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {AUTHORS_FTS_TABLE} USING fts5(name, tokenize='trigram')"
+    )
+
+
+def delete_authors(connection: Connection, author_ids: List[int]):
+    connection.execute(
+        sql_text(f'DELETE FROM {AUTHORS_FTS_TABLE} WHERE rowid IN (SELECT value FROM json_each(:ids))'),
+        {'ids': json.dumps(list(author_ids))}
+    )
+
+
+def index_authors(connection: Connection, authors: List[tuple]):
+    """
+    (Re-)indexes authors with their normalized names.
+
+    :param connection: Connection with an open transaction
+    :param authors: List of (id, first_name, last_name) tuples
+    """
+    if len(authors) == 0:
+        return
+
+    delete_authors(connection, [author_id for author_id, _, _ in authors])
+    connection.execute(
+        sql_text(f'INSERT INTO {AUTHORS_FTS_TABLE} (rowid, name) VALUES (:id, :name)'),
+        [
+            {'id': author_id, 'name': normalize_name(f'{first_name or ""} {last_name or ""}')}
+            for author_id, first_name, last_name in authors
+        ]
+    )
+
+
+def rebuild_author_index(connection: Connection):
+    connection.exec_driver_sql(f'DELETE FROM {AUTHORS_FTS_TABLE}')
+    table = Author.__table__
+    authors = connection.execute(select(table.c.id, table.c.first_name, table.c.last_name)).all()
+    index_authors(connection, authors)
+    logger.info(f'Indexed {len(authors)} authors')
+
+
+def search_authors(
+        connection: Connection,
+        name: str,
+        n: int | None = 20,
+        fuzzy: bool = False,
+        threshold: float = 0.5
+) -> pd.DataFrame:
+    """
+    Searches the author index. Names are compared after case and accent folding.
+
+    By default, every word of the query has to occur in the name, e.g. `lovel ada` finds `Ada Lovelace`.
+    A fuzzy search also finds names with typos. Candidates sharing trigrams with the query are ranked by the share of
+    the query trigrams they contain.
+
+    :param connection: Database connection
+    :param name: Name or part of a name in any order
+    :param n: Maximum number of authors. If None, all matching authors are returned.
+    :param fuzzy: If True, names that are similar to the query are returned as well.
+    :param threshold: Minimum share of the query trigrams a name must contain in a fuzzy search.
+    :return: DataFrame indexed by the author ids with the columns first_name, last_name and score.
+    """
+    query = normalize_name(name)
+    words = query.split()
+
+    if len(words) == 0:
+        return pd.DataFrame(columns=['first_name', 'last_name', 'score']).rename_axis('id')
+
+    params = {}
+    if fuzzy:
+        terms = sorted(t for t in trigrams(query) if len(t) == 3)
+        if len(terms) == 0:
+            # Too short for trigrams, fall back to a substring search
+            return search_authors(connection, name, n)
+        conditions = [f'{AUTHORS_FTS_TABLE} MATCH :match']
+        params['match'] = ' OR '.join(f'"{t}"' for t in terms)
+    else:
+        conditions = []
+        long_words = [word for word in words if len(word) >= 3]
+        if long_words:
+            conditions.append(f'{AUTHORS_FTS_TABLE} MATCH :match')
+            params['match'] = ' AND '.join(f'"{word}"' for word in long_words)
+        # Words shorter than a trigram cannot use the index
+        for i, word in enumerate(word for word in words if len(word) < 3):
+            conditions.append(f"name LIKE :like{i}")
+            params[f'like{i}'] = f'%{word}%'
+
+    sql = f"SELECT rowid, name FROM {AUTHORS_FTS_TABLE} WHERE {' AND '.join(conditions)}"
+    if fuzzy:
+        # Only the best candidates by bm25 are scored
+        sql += f' ORDER BY rank LIMIT {max(100, 20 * (n or 0))}'
+
+    rows = connection.execute(sql_text(sql), params).all()
+
+    query_trigrams = trigrams(query)
+    scores = {}
+    for author_id, author_name in rows:
+        score = len(query_trigrams & trigrams(author_name)) / len(query_trigrams)
+        if not fuzzy or score >= threshold:
+            # Ties are broken by the number of complete words and by the length of the name
+            complete_words = len(set(words) & set(author_name.split()))
+            scores[author_id] = (score, complete_words, -len(author_name))
+
+    ids = sorted(scores, key=scores.get, reverse=True)[:n]
+
+    authors = connection.execute(
+        sql_text('SELECT id, first_name, last_name FROM authors WHERE id IN (SELECT value FROM json_each(:ids))'),
+        {'ids': json.dumps(ids)}
+    ).all()
+
+    df = pd.DataFrame(authors, columns=['id', 'first_name', 'last_name']).set_index('id').reindex(ids)
+    df['score'] = [scores[author_id][0] for author_id in ids]
+    df.index.name = 'id'
+
+    return df
+
+
+@event.listens_for(Author, 'after_insert')
+@event.listens_for(Author, 'after_update')
+def _index_author(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        index_authors(connection, [(target.id, target.first_name, target.last_name)])
+
+
+@event.listens_for(Author, 'after_delete')
+def _remove_deleted_author(mapper, connection, target):
+    if connection.dialect.name == 'sqlite':
+        delete_authors(connection, [target.id])
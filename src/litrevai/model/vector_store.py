@@ -1,14 +1,16 @@
-from typing import Tuple, TYPE_CHECKING
+import threading
+from collections import OrderedDict
+from typing import Tuple, TYPE_CHECKING, Mapping
 
 import lancedb
 import pandas as pd
-from lancedb.embeddings import get_registry
+from lancedb.embeddings import get_registry, register, TextEmbeddingFunction
 from lancedb.pydantic import LanceModel, Vector, List
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from .database import *
+from litrevai.embeddings import DEFAULT_EMBEDDING_MODEL, get_device, get_embedding_model
 from litrevai.util import strip_references, _resolve_item_keys
-import torch
 
 import logging
 
@@ -20,14 +22,32 @@ if TYPE_CHECKING:
     from litrevai.literature_review import LiteratureReview
 
 
-if torch.backends.mps.is_available():
-    device = 'mps'
-elif torch.cuda.is_available():
-    device = 'cuda'
-else:
-    device = 'cpu'
+@register('litrevai-sentence-transformers')
+class SharedSentenceTransformerEmbeddings(TextEmbeddingFunction):
+    """
+    Sentence transformer embeddings that use the shared model of litrevai.embeddings instead of loading their own copy.
+    """
+    name: str = DEFAULT_EMBEDDING_MODEL
+    device: str = 'cpu'
+    normalize: bool = True
+
+    def ndims(self):
+        return get_embedding_model(self.name, self.device).get_sentence_embedding_dimension()
+
+    def generate_embeddings(self, texts):
+        return get_embedding_model(self.name, self.device).encode(
+            list(texts),
+            normalize_embeddings=self.normalize
+        ).tolist()
+
 
-model = get_registry().get("sentence-transformers").create(name="BAAI/bge-large-en-v1.5", device=device)
+device = get_device()
+
+model = get_registry().get('litrevai-sentence-transformers').create(name=DEFAULT_EMBEDDING_MODEL, device=device)
+
+
+# Upper limit for the number of chunks loaded for a single item
+MAX_CHUNKS = 100_000
 
 
 class Document(LanceModel):
@@ -43,8 +63,16 @@ class VectorStore:
     Manages access to the vector store and provides methods for RAG and similarity search.
     """
 
-    def __init__(self, lr: 'LiteratureReview', uri="./.lancedb", chunk_size=1024, chunk_overlap=256):
-
+    def __init__(self, lr: 'LiteratureReview', uri="./.lancedb", chunk_size=1024, chunk_overlap=256,
+                 context_cache_size=1024):
+        """
+        :param lr: LiteratureReview the store belongs to
+        :param uri: Directory of the lancedb database
+        :param chunk_size: Number of characters per chunk
+        :param chunk_overlap: Number of characters shared by consecutive chunks
+        :param context_cache_size: Maximum number of retrieved contexts kept for the next run (see retrieve).
+            The least recently used contexts are dropped first.
+        """
 
         self.lr = lr
         self.chunk_size = chunk_size
@@ -53,6 +81,13 @@ class VectorStore:
 
         self.documents = self.vs.create_table("documents", schema=Document.to_arrow_schema(), exist_ok=True)
 
+        # Formatted contexts retrieved during a dry run, consumed by the next call to rag. Least recently used first.
+        self._context_cache = OrderedDict()
+        self.context_cache_size = context_cache_size
+
+        # Guards the context cache and the table handle, queries of a project may retrieve from several threads
+        self._lock = threading.RLock()
+
         self.splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap,
@@ -68,6 +103,14 @@ class VectorStore:
             )
         return self.lr.llm
 
+    @staticmethod
+    def embed_query(search_phrase: str) -> list:
+        """
+        Embeds a search phrase with the shared embedding model. Tables created by earlier versions reference
+        the embedding function of lancedb, which would load a second copy of the model.
+        """
+        return model.compute_query_embeddings(search_phrase)[0]
+
     def delete_all(self):
         self.documents = self.vs.create_table("documents", schema=Document.to_arrow_schema(), mode='overwrite')
 
@@ -96,13 +139,55 @@ class VectorStore:
 
         data = pd.DataFrame({
             'text': texts,
-            'chunk': range(n)
+            'chunk': range(n),
+            'vector': model.compute_source_embeddings(texts)
         }).assign(key=key)
 
         self.documents.add(data=data)
 
         return True
 
+    def add_texts(self, texts: Mapping[str, str], batch_size: int = 256, replace: bool = False) -> List[str]:
+        """
+        Adds many texts to the vector store. Keys that are already stored are skipped with a single lookup and the
+        chunks of all texts are embedded in batches.
+
+        :param texts: Mapping of item keys to full texts
+        :param batch_size: Number of chunks embedded per call
+        :param replace: If True, stored chunks of the keys are deleted and the texts are embedded again.
+        :return: Keys of the added texts
+        """
+        if len(texts) == 0:
+            return []
+
+        key_string = ', '.join([f"'{key}'" for key in texts])
+
+        if replace:
+            self.documents.delete(f'key IN ({key_string})')
+            stored = set()
+        else:
+            stored = self.documents.search().where(f'key IN ({key_string})').select(['key']).limit(MAX_CHUNKS).to_pandas()
+            stored = set(stored['key']) if len(stored) > 0 else set()
+
+        for key in stored:
+            logger.warning(f'Document with key {key} already in Vector store')
+
+        keys = [key for key in texts if key not in stored]
+
+        data = []
+        for key in keys:
+            chunks = self.splitter.split_text(texts[key])
+            data.extend({'text': text, 'chunk': i, 'key': key} for i, text in enumerate(chunks))
+
+        for i in range(0, len(data), batch_size):
+            batch = pd.DataFrame(data[i:i + batch_size])
+            batch['vector'] = model.compute_source_embeddings(batch['text'].tolist())
+            self.documents.add(data=batch)
+
+        logger.info(f'Added {len(keys)} items with {len(data)} chunks to vectorstore')
+
+        return keys
+
     def get_context(self, search_phrase, items: None | List[str] | str | pd.DataFrame = None, n=10, sort_by_position=True) -> pd.DataFrame:
         """
         Retrieves the context that fits the query using similarity search.
@@ -116,6 +201,8 @@ class VectorStore:
 
         # TODO: Add re-ranker (https://huggingface.co/BAAI/bge-reranker-v2-m3)
 
+        filter_keys = None
+
         if items is not None:
 
             if type(items) == str:
@@ -129,9 +216,13 @@ class VectorStore:
             elif isinstance(items, BibliographyItem):
                 filter_keys = "key = '{}'".format(items.key)
 
-            context = self.documents.search(search_phrase).where(filter_keys, prefilter=True).limit(n).to_pandas()
-        else:
-            context = self.documents.search(search_phrase).limit(n).to_pandas()
+        vector = self.embed_query(search_phrase)
+
+        with self._lock:
+            search = self.documents.search(vector)
+            if filter_keys is not None:
+                search = search.where(filter_keys, prefilter=True)
+            context = search.limit(n).to_pandas()
 
         if sort_by_position:
             context = context.sort_values('chunk')
@@ -178,6 +269,109 @@ class VectorStore:
         return formatted_context
 
 
+    def clear_context_cache(self):
+        with self._lock:
+            self._context_cache = OrderedDict()
+
+    def retrieve(
+            self,
+            prompt: Prompt,
+            keys: None | str | List[str] = None,
+            sort_by_position=True,
+            n=10,
+            add_meta=True,
+            cache=False,
+            with_chunks=False
+    ) -> str | Tuple[str, list]:
+        """
+        Retrieves and formats the context for a prompt without calling the language model.
+
+        :param prompt: Prompt which contains the search phrase
+        :param keys: Items to retrieve the context from.
+        :param sort_by_position: If true, sorts retrieved context by its position in the text rather than by its similarity.
+        :param n: Number of context chunks to be retrieved.
+        :param add_meta: If true, adds title, authors, year and keywords of each item to the context.
+        :param cache: If true, the context is kept so the next call to rag with the same arguments reuses it.
+            At most context_cache_size contexts are kept.
+        :param with_chunks: If true, also returns the references (key, chunk, distance) of the retrieved chunks.
+        :return: The formatted context and optionally the chunk references
+        """
+        cache_key = (
+            prompt.search_phrase,
+            keys if keys is None or isinstance(keys, str) else tuple(keys),
+            n,
+            sort_by_position,
+            add_meta
+        )
+
+        with self._lock:
+            if cache:
+                cached = self._context_cache.get(cache_key)
+                if cached is not None:
+                    self._context_cache.move_to_end(cache_key)
+            else:
+                cached = self._context_cache.pop(cache_key, None)
+
+        if cached is not None:
+            formatted_context, chunks = cached
+        else:
+            context = self.get_context(search_phrase=prompt.search_phrase, items=keys, n=n, sort_by_position=sort_by_position)
+
+            formatted_context = self.format_context(context, add_meta=add_meta)
+            chunks = [
+                [key, int(chunk), float(distance)]
+                for key, chunk, distance in zip(context['key'], context['chunk'], context['_distance'])
+            ]
+
+            if cache:
+                with self._lock:
+                    self._context_cache[cache_key] = (formatted_context, chunks)
+                    while len(self._context_cache) > self.context_cache_size:
+                        self._context_cache.popitem(last=False)
+
+        if with_chunks:
+            return formatted_context, chunks
+        return formatted_context
+
+    def get_chunks(self, key: str, chunks: List[int] | None = None) -> pd.DataFrame:
+        """
+        Returns the stored chunks of an item.
+
+        :param key: Key of the item
+        :param chunks: Optional positions of the chunks. If None, all chunks of the item are returned.
+        :return: DataFrame with the columns key, chunk and text ordered by the position of the chunks.
+        """
+        where = f"key = '{key}'"
+        if chunks is not None:
+            where += f" AND chunk IN ({', '.join(str(chunk) for chunk in chunks)})"
+
+        with self._lock:
+            df = self.documents.search().where(where).limit(MAX_CHUNKS).to_pandas()
+
+        return df[['key', 'chunk', 'text']].sort_values('chunk')
+
+    def format_chunks(self, chunks: list, add_meta=True) -> str:
+        """
+        Reconstructs the formatted context from stored chunk references.
+
+        :param chunks: List of (key, chunk, distance) references as returned by retrieve.
+        :param add_meta: If true, adds title, authors, year and keywords of each item to the context.
+        :return: The formatted context
+        """
+        if not chunks:
+            return ''
+
+        references = pd.DataFrame(chunks, columns=['key', 'chunk', '_distance'])
+
+        texts = pd.concat([
+            self.get_chunks(key, group['chunk'].tolist()) for key, group in references.groupby('key')
+        ])
+
+        # Keep the order in which the chunks were retrieved
+        context = references.merge(texts, on=['key', 'chunk'], how='left')
+
+        return self.format_context(context, add_meta=add_meta)
+
     def rag(
             self,
             prompt: Prompt | str,
@@ -188,7 +382,8 @@ class VectorStore:
             sort_by_position=True,
             n=10,
             add_meta=True,
-            additional_context: dict | None = None
+            additional_context: dict | None = None,
+            keyword: str | None = None
     ) -> Tuple[str, str]:
 
         """
@@ -202,16 +397,23 @@ class VectorStore:
         :param sort_by_position: If true, sorts retrieved context by its position in the text rather than by its similarity.
         :param n: Number of context chunks to be retrieved. High values may lead to exceeded context size.
         :param additional_context: Dict containing addition metadata that is added to the context.
-        :return: Tuple with the answer and the retrieved context.
+        :param keyword: Optional keyword query. The context is only retrieved from items matching the keywords.
+        :return: Tuple with the answer and the retrieved context. Both are empty if no item matches the keywords,
+            the LLM is not called then.
         """
 
+        if keyword is not None:
+            keys = [keys] if isinstance(keys, str) else keys
+            keys = self.lr.db.keyword_search(keyword, n=None, keys=keys, snippets=False).index.tolist()
+            if len(keys) == 0:
+                logger.info(f'No items match the keywords: {keyword}')
+                return '', ''
+
         if isinstance(prompt, str):
             from litrevai.prompt import OpenPrompt
             prompt = OpenPrompt(question=prompt)
 
-        context = self.get_context(search_phrase=prompt.search_phrase, items=keys, n=n, sort_by_position=sort_by_position)
-
-        formatted_context = self.format_context(context, add_meta=add_meta)
+        formatted_context = self.retrieve(prompt, keys=keys, sort_by_position=sort_by_position, n=n, add_meta=add_meta)
 
         if additional_context is not None:
             lines = []
@@ -1,12 +1,15 @@
 import json
-from typing import List, TYPE_CHECKING
+from typing import List, TYPE_CHECKING, Mapping, Any
 
 import pandas as pd
+from sqlalchemy import select
 
 from .util import _resolve_item_keys
+from .estimate import CostEstimate
+from .llm import BaseLLM, ModelCascade
 from .prompt import Prompt
 from .query import Query
-from .model.models import BibliographyItem, ProjectModel, Collection, Library, QueryModel
+from .model.models import BibliographyItem, ProjectModel, Collection, Library, QueryModel, item_project_association
 
 if TYPE_CHECKING:
     from .literature_review import LiteratureReview
@@ -57,13 +60,15 @@ class Project:
         }
 
 
-    def create_query(self, name: str, prompt: Prompt, exists_ok=True) -> Query:
+    def create_query(self, name: str, prompt: Prompt, exists_ok=True, depends_on: Query | Mapping[Query, Any] | None = None) -> Query:
         """
         Create a query and add it to the project.
         Raises an error if a query with the given name already exists.
 
         :param name: Unique name for the prompt.
         :param prompt: A prompt that inherits from Prompt.
+        :param depends_on: Optional query or dict of queries and values. The query only runs on items where the
+            responses to these queries are equal to the values. A single query requires the value True.
         :return: Returns the created prompt
         """
         with self.Session(expire_on_commit=False) as session:
@@ -88,6 +93,14 @@ class Project:
                     raise Exception(f'Query with name {name} already exists.')
 
         query = Query(self.lr, query_id=query_model.id)
+
+        if isinstance(depends_on, Query):
+            depends_on = {depends_on: True}
+
+        if depends_on:
+            for parent, value in depends_on.items():
+                query.add_dependency(parent, value=value)
+
         return query
 
     def delete_query(self, name: str) -> None:
@@ -111,13 +124,20 @@ class Project:
 
     @property
     def items(self) -> pd.DataFrame:
-        with self.Session() as session:
-            items = session.get(ProjectModel, self.project_id).items
-
-        df = BibliographyItem.to_df(items)
+        keys = select(item_project_association.c.bibliography_key).where(
+            item_project_association.c.project_id == self.project_id
+        )
+        df = self.db.read_items(BibliographyItem.key.in_(keys))
         return df
 
 
+    def get_texts(self) -> pd.Series:
+        """
+        Returns the full texts of all items in the project.
+        """
+        return self.lr.get_texts(self.items)
+
+
     def rag(self, prompt, items = None):
         if items is None:
             items = self.items
@@ -142,9 +162,8 @@ class Project:
         )
         return df
 
-    @property
-    def import_bibtex(self, path_to_bibtex: str):
-        self.lr.import_bibtex(path_to_bibtex, self.project_id)
+    def import_bibtex(self, path_to_bibtex: str, workers: int | None = None) -> pd.DataFrame:
+        return self.lr.import_bibtex(path_to_bibtex, self.project_id, workers=workers)
 
 
     def test(self):
@@ -196,8 +215,19 @@ class Project:
             session.commit()
 
 
-    def run(self, include_keys: List[str] | None = None):
-        self.lr.run_project(self.project_id, include_keys=include_keys)
+    def run(self, include_keys: List[str] | None = None, llms: List[BaseLLM] | ModelCascade | None = None, workers: int = 1):
+        self.lr.run_project(self.project_id, include_keys=include_keys, llms=llms, workers=workers)
+
+
+    def estimate(self, include_keys: List[str] | None = None, **kwargs) -> CostEstimate:
+        """
+        Performs a dry run of all queries in the project and estimates the number of tokens and the costs of running it.
+        See LiteratureReview.estimate_project for the available arguments.
+
+        :param include_keys:
+        :return:
+        """
+        return self.lr.estimate_project(self.project_id, include_keys=include_keys, **kwargs)
 
 
     def add_items_from_collection(self, collection_name):
@@ -214,7 +244,7 @@ class Project:
 
     def to_excel(self, filepath, query_names=None, items=None):
         responses = self.responses
-        items = self.items[['DOI', 'ISBN', 'title', 'year', 'authors_list']]
+        items = self.items[['DOI', 'ISBN', 'title', 'year', 'authors']]
         df = responses.join(items)
 
         keys = _resolve_item_keys(items)
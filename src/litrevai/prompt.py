@@ -1,6 +1,7 @@
 import json
 import re
 import importlib.resources
+from functools import lru_cache
 from typing import List, Mapping
 
 package_name = __package__
@@ -15,12 +16,42 @@ def register_prompt(cls):
     return cls
 
 
+@lru_cache(maxsize=None)
+def read_system_prompt(name: str) -> str:
+    """
+    Reads the system prompt template from the package data. The file is only read once per process.
+    """
+    if package_name is None:
+        with open(f'data/prompts/{name}.txt', 'r') as f:
+            return f.read()
+
+    with importlib.resources.open_text(package_name + '.data.prompts', f'{name}.txt') as file:
+        return file.read()
+
+
+@lru_cache(maxsize=256)
+def load_prompt(prompt_type: str, question: str, params: str) -> 'Prompt':
+    """
+    Returns the prompt for a stored query. Instances are cached by type, question and JSON encoded params,
+    so parsing many responses to the same query builds the prompt only once.
+
+    :param prompt_type: Name of the registered prompt class.
+    :param question: The question of the query.
+    :param params: JSON encoded parameters of the prompt.
+    :return: Prompt instance
+    """
+    return prompt_registry[prompt_type](question=question, **json.loads(params))
+
+
 class Prompt:
     name: str = 'default'
     system_prompt: str
     question: str
     params: dict = {}
 
+    # Increase when parse_value changes, so that the values stored with the responses are parsed again.
+    parser_version: int = 1
+
     def __init__(self, question, **params):
         """
         Base class for all prompts.
@@ -46,12 +77,7 @@ class Prompt:
             self.search_phrase = search_phrase
 
     def _load_system_prompt(self):
-        if package_name is None:
-            with open(f'data/prompts/{self.name}.txt', 'r') as f:
-                return f.read()
-
-        with importlib.resources.open_text(package_name + '.data.prompts', f'{self.name}.txt') as file:
-            return file.read()
+        return read_system_prompt(self.name)
 
     def parse_value(self, answer):
         return answer
@@ -1,8 +1,11 @@
 import json
+import os
 from typing import List, TYPE_CHECKING
 
 import pandas as pd
 
+from .estimate import CostEstimate
+from .llm import BaseLLM, ModelCascade
 from .prompt import Prompt
 from .model.models import QueryModel
 from .topic_modelling import TopicModel
@@ -87,6 +90,33 @@ class Query:
         keys = list(responses[responses == value].index)
         return keys
 
+    @property
+    def dependencies(self) -> dict:
+        """
+        Returns a dict mapping the names of the queries this query depends on to the values their responses must have.
+        """
+        with self.Session() as session:
+            dependencies = self.db.get_query_dependencies(session, self.query_id)
+            names = {
+                query_id: self.db.get_query_by_id(session, query_id).name
+                for query_id in dependencies
+            }
+
+        return {names[query_id]: value for query_id, value in dependencies.items()}
+
+    def add_dependency(self, query: 'Query', value=True) -> None:
+        """
+        Runs this query only on items where the parsed response to the given query equals the value.
+        Running the project evaluates the queries in the order of their dependencies.
+
+        :param query: Query that has to be answered first.
+        :param value: Value the response must have. Must be JSON serializable.
+        """
+        self.db.add_query_dependency(self.query_id, query.query_id, value=value)
+
+    def remove_dependency(self, query: 'Query') -> None:
+        self.db.remove_query_dependency(self.query_id, query.query_id)
+
     @property
     def query_id(self):
         return self._query_id
@@ -204,10 +234,35 @@ class Query:
 
         return app
 
-    def run(self, items: List[str] | pd.DataFrame | None = None):
+    def run(self, items: List[str] | pd.DataFrame | None = None, llms: List[BaseLLM] | ModelCascade | None = None):
+        """
+        Runs the query over the items of the project.
+
+        :param items: Items to restrict the run to.
+        :param llms: Optional list of language models ordered from the cheapest to the strongest.
+            Uncertain answers of a model are escalated to the next one.
+        """
+        include_keys = _resolve_item_keys(items)
+
+        self.lr.run_query(self.query_id, include_keys=include_keys, llms=llms)
+
+    def tier_distribution(self) -> pd.Series:
+        """
+        Returns the number of responses produced by each model of a cascade.
+        """
+        return self.db.get_response_models(self.query_id).value_counts(dropna=False)
+
+    def estimate(self, items: List[str] | pd.DataFrame | None = None, **kwargs) -> CostEstimate:
+        """
+        Performs a dry run of the query and estimates the number of tokens and the costs of running it.
+        See LiteratureReview.estimate_query for the available arguments.
+
+        :param items: Items to restrict the run to.
+        :return:
+        """
         include_keys = _resolve_item_keys(items)
 
-        self.lr.run_query(self.query_id, include_keys=include_keys)
+        return self.lr.estimate_query(self.query_id, include_keys=include_keys, **kwargs)
 
     def summarize(self):
         """
@@ -219,8 +274,10 @@ class Query:
     def test(self):
         self.lr.test_query(self.query_id)
 
-    def create_topic_model(self, **kwargs):
-
+    def _topic_model_responses(self) -> pd.Series:
+        """
+        Returns the responses as documents for a topic model. List responses are exploded into one document per entry.
+        """
         responses = self.responses
 
         responses = responses[~responses.isna()]
@@ -236,6 +293,13 @@ class Query:
 
         responses.name = 'response'
 
+        return responses
+
+    def create_topic_model(self, **kwargs):
+
+        responses = self._topic_model_responses()
+
+        kwargs.setdefault('embedding_cache', os.path.join(self.lr.path, 'embeddings'))
 
         topic_model = TopicModel(
             question=self.question,
@@ -246,6 +310,17 @@ class Query:
         )
         return topic_model
 
+    def update_topic_model(self, topic_model: TopicModel) -> pd.DataFrame:
+        """
+        Assigns topics to the responses that were added since the topic model was created, e.g. after new items were
+        added to the project and the query was run again. The topics and their labels are kept.
+        Use `topic_model.drift()` to check whether a new topic model should be created.
+
+        :param topic_model: Topic model created from this query.
+        :return: The new responses with their topics.
+        """
+        return topic_model.update(self._topic_model_responses(), items=self.project.items)
+
     def __repr__(self):
         model = self._query_model
         return f"Query(\"{model.question}\", type={self.prompt_type})"
@@ -1,18 +1,264 @@
+import collections
+import hashlib
+import importlib.util
+import itertools
 import json
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import plotly.graph_objects as go
 import plotly.express as px
+import numpy as np
 import pandas as pd
 import re
 import nltk
 from nltk.corpus import stopwords
 import pandas as pd
+from tqdm.auto import tqdm
 from bertopic import BERTopic
-from sentence_transformers import SentenceTransformer
 from umap import UMAP
 from sklearn.feature_extraction.text import CountVectorizer
 from hdbscan import HDBSCAN
+from .embeddings import DEFAULT_EMBEDDING_MODEL, EmbeddingCache, get_embedding_model
 from .llm import BaseLLM
-from scipy.spatial.distance import cosine
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of responses for which find_document uses an approximate nearest neighbour index by default
+ANN_MIN_DOCUMENTS = 50_000
+
+# Share of the fitted responses the prediction of the clustering model has to assign to their topics. Below, new
+# responses are assigned to the topic with the nearest centroid instead.
+MIN_PREDICTION_AGREEMENT = 0.9
+
+# Parameters of fit_model that can be varied by a sweep, with their defaults. The UMAP parameters are fixed per sweep,
+# so that all configurations share one reduction.
+SWEEP_PARAMETERS = {
+    'min_cluster_size': 2,
+    'min_samples': None,
+    'cluster_selection_method': 'leaf',
+    'nr_topics': None,
+    'min_df': 1,
+    'max_df': 0.8,
+}
+
+
+def hash_array(array) -> str:
+    array = np.ascontiguousarray(array)
+    return hashlib.sha1(array.tobytes()).hexdigest() + str(array.shape)
+
+
+class UMAPCache:
+    """
+    Reduced embeddings of the most recent UMAP fits of a topic model and the most recently fitted UMAP model.
+    Only the reductions of the training data are kept, a fitted model (with its neighbour graph and training data)
+    is only needed to transform new data.
+    """
+
+    def __init__(self, maxsize=8):
+        """
+        :param maxsize: Number of reductions that are kept. The least recently used reductions are dropped first.
+        """
+        self.maxsize = maxsize
+        self.embeddings = OrderedDict()
+        self.model_key = None
+        self.model = None
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def get_embedding(self, key) -> np.ndarray | None:
+        if key not in self.embeddings:
+            return None
+        self.embeddings.move_to_end(key)
+        return self.embeddings[key]
+
+    def get_model(self, key) -> UMAP | None:
+        return self.model if self.model_key == key else None
+
+    def put(self, key, umap: UMAP):
+        self.embeddings[key] = umap.embedding_
+        while len(self.embeddings) > self.maxsize:
+            self.embeddings.popitem(last=False)
+        self.model_key, self.model = key, umap
+
+    def clear(self):
+        self.embeddings.clear()
+        self.model_key, self.model = None, None
+
+
+class CachedUMAP:
+    """
+    UMAP for BERTopic that reuses the reductions of earlier fits with the same embeddings and parameters.
+    Refitting a topic model with different clustering or vectorizer parameters then skips the dimensionality reduction.
+    """
+
+    def __init__(self, cache: UMAPCache, **params):
+        """
+        :param cache: Cache shared between the fits of a topic model.
+        :param params: Arguments passed to UMAP
+        """
+        self.cache = cache
+        self.params = params
+        self.key = None
+        self.embedding_ = None
+        self._X = None
+        self._y = None
+
+    def fit(self, X, y=None):
+        self._X, self._y = X, y
+        self.key = (hash_array(X), None if y is None else hash_array(y), tuple(sorted(self.params.items())))
+
+        self.embedding_ = self.cache.get_embedding(self.key)
+        if self.embedding_ is None:
+            self._fit_model()
+
+        return self
+
+    def _fit_model(self) -> UMAP:
+        umap = UMAP(**self.params).fit(self._X, y=self._y)
+        self.cache.put(self.key, umap)
+        self.embedding_ = umap.embedding_
+        return umap
+
+    def transform(self, X):
+        if X is self._X or hash_array(X) == self.key[0]:
+            return self.embedding_
+
+        # New data needs the fitted model. It is refitted if another fit replaced it, UMAP is seeded and
+        # reproduces the same reduction.
+        umap = self.cache.get_model(self.key) or self._fit_model()
+        return umap.transform(X)
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X, y=y).transform(X)
+
+
+def create_vectorizer_model(min_df=1, max_df=0.8) -> CountVectorizer:
+    return CountVectorizer(
+        stop_words=list(stopwords.words('english')),
+        min_df=min_df,
+        max_df=max_df,
+        ngram_range=(1, 3)
+    )
+
+
+def create_hdbscan_model(min_cluster_size=2, min_samples=None, cluster_selection_method='leaf', prediction_data=True):
+    return HDBSCAN(
+        min_cluster_size=min_cluster_size,
+        min_samples=min_samples,
+        metric='euclidean',
+        cluster_selection_method=cluster_selection_method,
+        prediction_data=prediction_data
+    )
+
+
+def topic_coherence(topic_model: BERTopic, docs: list, top_n_words=10) -> float:
+    """
+    Returns the mean NPMI coherence of the topics (without outliers). The co-occurrence of the top words of a topic is
+    counted in the documents. Values range from -1 (the words never occur together) to 1 (they always occur together).
+
+    :param topic_model: Fitted BERTopic model
+    :param docs: Documents the model was fitted on
+    :param top_n_words: Number of words per topic
+    """
+    vectorizer = topic_model.vectorizer_model
+    vocabulary = vectorizer.vocabulary_
+    occurrences = (vectorizer.transform(docs) > 0).astype(np.float64).tocsc()
+    n_docs = occurrences.shape[0]
+
+    coherences = []
+    for topic, words in topic_model.get_topics().items():
+        if topic == -1:
+            continue
+
+        columns = [vocabulary[word] for word, _ in words[:top_n_words] if word in vocabulary]
+        if len(columns) < 2:
+            continue
+
+        sub = occurrences[:, columns]
+        joint = (sub.T @ sub).toarray() / n_docs
+        marginal = np.diag(joint)
+
+        i, j = np.triu_indices(len(columns), k=1)
+        p_ij = joint[i, j]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            npmi = np.log(p_ij / (marginal[i] * marginal[j])) / -np.log(p_ij)
+        # Words that never occur together have the minimal coherence, words that always do the maximal one
+        npmi = np.where(p_ij == 0, -1.0, np.where(p_ij == 1, 1.0, npmi))
+
+        coherences.append(npmi.mean())
+
+    return float(np.mean(coherences)) if coherences else np.nan
+
+
+# Reduced embeddings and documents of the sweep, set once per worker process
+_sweep_data = {}
+
+
+def _init_sweep_worker(reduced_embeddings: np.ndarray, docs: list):
+    _sweep_data['reduced_embeddings'] = reduced_embeddings
+    _sweep_data['docs'] = docs
+
+
+def _evaluate_configuration(params: dict, top_n_words: int = 10) -> dict:
+    """
+    Clusters the reduced embeddings of the sweep with one configuration and scores the result. No labels are generated.
+    """
+    from bertopic.dimensionality import BaseDimensionalityReduction
+    from sklearn.metrics import silhouette_score
+
+    reduced_embeddings = _sweep_data['reduced_embeddings']
+    docs = _sweep_data['docs']
+    params = {**SWEEP_PARAMETERS, **params}
+
+    topic_model = BERTopic(
+        umap_model=BaseDimensionalityReduction(),
+        hdbscan_model=create_hdbscan_model(
+            min_cluster_size=params['min_cluster_size'],
+            min_samples=params['min_samples'],
+            cluster_selection_method=params['cluster_selection_method'],
+            prediction_data=False
+        ),
+        vectorizer_model=create_vectorizer_model(min_df=params['min_df'], max_df=params['max_df']),
+        top_n_words=top_n_words,
+        nr_topics=params['nr_topics'],
+        verbose=False
+    )
+
+    topic_model.fit(docs, reduced_embeddings)
+    topics = np.asarray(topic_model.topics_)
+
+    clustered = topics != -1
+    n_topics = len(np.unique(topics[clustered]))
+
+    if 2 <= n_topics < clustered.sum():
+        silhouette = float(silhouette_score(reduced_embeddings[clustered], topics[clustered]))
+    else:
+        silhouette = np.nan
+
+    return {
+        'n_topics': n_topics,
+        'outlier_ratio': float(1 - clustered.mean()),
+        'coherence': topic_coherence(topic_model, docs, top_n_words=top_n_words),
+        'silhouette': silhouette,
+    }
+
+
+def jensen_shannon_distance(p: np.ndarray, q: np.ndarray) -> float:
+    """
+    Jensen-Shannon distance (base 2) between two distributions. 0 for identical and 1 for disjoint distributions.
+    """
+    p = p / p.sum()
+    q = q / q.sum()
+    m = (p + q) / 2
+
+    def kl(a, b):
+        mask = a > 0
+        return np.sum(a[mask] * np.log2(a[mask] / b[mask]))
+
+    return float(np.sqrt(max((kl(p, m) + kl(q, m)) / 2, 0)))
 
 
 class TopicModel:
@@ -25,7 +271,40 @@ class TopicModel:
     _items: pd.DataFrame
     df: pd.DataFrame
 
-    def __init__(self, question, items, responses, llm: BaseLLM | None = None, embeddings_model="BAAI/bge-large-en-v1.5", **kwargs):
+    _normalized_embeddings: np.ndarray | None = None
+    _ann_index = None
+    _ann_ef: int = 50
+    _document_info: pd.DataFrame | None = None
+
+    # Number of responses the topic model was fitted on. Responses added by update follow them.
+    _n_fitted: int = 0
+
+    # Whether new responses are assigned to the topic with the nearest centroid, see _predict. None until checked.
+    _predict_by_centroid: bool | None = None
+
+    def __init__(
+            self,
+            question,
+            items,
+            responses,
+            llm: BaseLLM | None = None,
+            embeddings_model=DEFAULT_EMBEDDING_MODEL,
+            embedding_cache: str | EmbeddingCache | None = None,
+            fit: bool = True,
+            **kwargs
+    ):
+        """
+        :param question: Question of the query the responses answer.
+        :param items: Items of the project.
+        :param responses: Series of response texts indexed by the item keys.
+        :param llm: Language model used to label the topics.
+        :param embeddings_model: Name of the SentenceTransformer model.
+        :param embedding_cache: Optional EmbeddingCache or directory of one. Only responses that are not cached are
+            encoded.
+        :param fit: If False, the model is not fitted (and no labels are generated) until fit_model is called,
+            e.g. with the best configuration of a sweep.
+        :param kwargs: Arguments passed to fit_model
+        """
 
         self.question = question
         self._items = items
@@ -36,11 +315,19 @@ class TopicModel:
         nltk.download('stopwords', quiet=True)
 
         self.responses = responses
-        self.embedding_model = SentenceTransformer(embeddings_model, trust_remote_code=True)
+        self.embedding_model = get_embedding_model(embeddings_model, trust_remote_code=True)
+
+        # Reductions by embeddings and UMAP parameters, so that refits only re-run the clustering
+        self._umap_cache = UMAPCache()
+
+        if isinstance(embedding_cache, str):
+            embedding_cache = EmbeddingCache(embedding_cache, embeddings_model)
+        self.embedding_cache = embedding_cache
 
         self._recalculate_embeddings()
 
-        self.fit_model(**kwargs)
+        if fit:
+            self.fit_model(**kwargs)
 
 
     @property
@@ -51,18 +338,74 @@ class TopicModel:
     def find_topics(self, search_term: str, top_n=5):
         return self.topic_model.find_topics(search_term=search_term, top_n=top_n)
 
-    def find_document(self, search_term: str, top_n=5):
-        term_embedding = self.embedding_model.encode(search_term)
+    def find_document(self, search_term: str, top_n=5, use_ann: bool | None = None):
+        """
+        Returns the responses that are most similar to the search term.
+
+        :param search_term: Text to search for.
+        :param top_n: Number of responses to return.
+        :param use_ann: If True, an approximate nearest neighbour index (hnswlib) is used. If None, the index is used
+            when hnswlib is installed and there are at least ANN_MIN_DOCUMENTS responses.
+        :return: Document info of the responses with their cosine similarity, ordered by the similarity.
+        """
+        term_embedding = np.asarray(self.embedding_model.encode(search_term), dtype=np.float32)
+        term_embedding = term_embedding / np.linalg.norm(term_embedding)
+
+        # More results than responses are not available
+        top_n = min(top_n, len(self.embeddings))
+        if top_n <= 0:
+            return self._get_document_info().iloc[:0].assign(similarities=[])
+
+        if use_ann is None:
+            use_ann = len(self.embeddings) >= ANN_MIN_DOCUMENTS and importlib.util.find_spec('hnswlib') is not None
+
+        if use_ann:
+            if self._ann_index is None:
+                self.build_ann_index()
+            # hnswlib requires a candidate list at least as long as the number of results
+            self._ann_index.set_ef(max(self._ann_ef, top_n))
+            labels, distances = self._ann_index.knn_query(term_embedding, k=top_n)
+            indices, similarities = labels[0], 1 - distances[0]
+        else:
+            all_similarities = self.normalized_embeddings @ term_embedding
+            indices = np.argpartition(-all_similarities, top_n - 1)[:top_n]
+            indices = indices[np.argsort(-all_similarities[indices])]
+            similarities = all_similarities[indices]
+
+        document_info = self._get_document_info()
+
+        return document_info.iloc[indices].assign(similarities=similarities)
+
+    @property
+    def normalized_embeddings(self) -> np.ndarray:
+        """
+        Embeddings scaled to unit length, so that dot products are cosine similarities.
+        """
+        if self._normalized_embeddings is None:
+            embeddings = np.asarray(self.embeddings, dtype=np.float32)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            self._normalized_embeddings = embeddings / np.where(norms == 0, 1, norms)
+        return self._normalized_embeddings
 
-        similarities = [1 - cosine(term_embedding, emb) for emb in self.embeddings]
+    def build_ann_index(self, M=16, ef_construction=200, ef=50):
+        """
+        Builds an HNSW index over the response embeddings for find_document. Requires hnswlib.
 
-        document_info = self.get_document_info()
+        :param M: Number of links per node
+        :param ef_construction: Size of the candidate list while building
+        :param ef: Size of the candidate list while searching. Higher values are more accurate and slower.
+        """
+        import hnswlib
 
-        document_info = document_info.assign(similarities=similarities)
+        embeddings = self.normalized_embeddings
 
-        document_info = document_info.sort_values('similarities', ascending=False)
+        index = hnswlib.Index(space='cosine', dim=embeddings.shape[1])
+        index.init_index(max_elements=len(embeddings), M=M, ef_construction=ef_construction)
+        index.add_items(embeddings, np.arange(len(embeddings)))
+        index.set_ef(ef)
 
-        return document_info.iloc[:top_n]
+        self._ann_index = index
+        self._ann_ef = ef
 
 
     def _repr_markdown_(self):
@@ -86,6 +429,15 @@ class TopicModel:
         Gets all documents together with the corresponding topic and
         :return:
         """
+        return self._get_document_info().copy()
+
+    def _get_document_info(self):
+        # Cached until the topics or their labels change
+        if self._document_info is None:
+            self._document_info = self._build_document_info()
+        return self._document_info
+
+    def _build_document_info(self):
 
         columns = ['title', 'year', 'DOI', 'typeName', 'series', 'journal']
         items = self.items[columns]
@@ -154,19 +506,29 @@ class TopicModel:
             docs=self.docs,
             topics_to_merge=topics_to_merge
         )
+        self._predict_by_centroid = None
 
         self._update_df()
 
         self.generate_names()
 
 
+    def _encode(self, docs):
+        if self.embedding_cache is not None:
+            return self.embedding_cache.encode(docs, self.embedding_model, show_progress_bar=True)
+        else:
+            return self.embedding_model.encode(
+                docs,
+                show_progress_bar=True
+            )
+
     def _recalculate_embeddings(self):
-        embeddings = self.embedding_model.encode(
-            self.docs,
-            show_progress_bar=True
-        )
+        embeddings = self._encode(self.docs)
 
         self.embeddings = embeddings
+        self._normalized_embeddings = None
+        self._ann_index = None
+        self._umap_cache.clear()
 
     def interact(self):
 
@@ -185,11 +547,14 @@ class TopicModel:
             max_df=(0.0, 1.0, 0.01),
             n_components=fixed(5),
             n_neighbors=fixed(15),
+            min_dist=fixed(0.1),
             cluster_selection_method=widgets.Dropdown(options=['leaf', 'eom'], value='leaf')
         )
 
 
     def _update_df(self):
+        self._document_info = None
+
         topics = self.topic_model.topics_
         embeddings = self.embeddings
 
@@ -205,6 +570,7 @@ class TopicModel:
             min_samples=None,
             n_neighbors=15,
             n_components=5,
+            min_dist=0.1,
             cluster_selection_method='leaf',
             language='english',
             seed_topic_list=None,
@@ -213,29 +579,14 @@ class TopicModel:
             nr_topics=None,
     ):
 
-        stop_words = list(stopwords.words('english'))
-
-        umap_model = UMAP(
-            n_neighbors=n_neighbors,
-            n_components=n_components,
-            min_dist=0.1,
-            metric='cosine',
-            random_state=42,
-        )
+        umap_model = self._create_umap_model(n_neighbors=n_neighbors, n_components=n_components, min_dist=min_dist)
 
-        vectorizer_model = CountVectorizer(
-            stop_words=stop_words,
-            min_df=min_df,
-            max_df=max_df,
-            ngram_range=(1, 3)
-        )
+        vectorizer_model = create_vectorizer_model(min_df=min_df, max_df=max_df)
 
-        hdbscan_model = HDBSCAN(
+        hdbscan_model = create_hdbscan_model(
             min_cluster_size=min_cluster_size,
             min_samples=min_samples,
-            metric='euclidean',
-            cluster_selection_method=cluster_selection_method,
-            prediction_data=True
+            cluster_selection_method=cluster_selection_method
         )
 
         topic_model = BERTopic(
@@ -254,12 +605,378 @@ class TopicModel:
         topics, probs = topic_model.fit_transform(self.docs, self.embeddings)
 
         self.topic_model = topic_model
+        self._n_fitted = len(self.docs)
+        self._predict_by_centroid = None
 
         self._update_df()
 
         self.generate_names()
 
 
+    def _create_umap_model(self, n_neighbors=15, n_components=5, min_dist=0.1) -> CachedUMAP:
+        return CachedUMAP(
+            self._umap_cache,
+            n_neighbors=n_neighbors,
+            n_components=n_components,
+            min_dist=min_dist,
+            metric='cosine',
+            random_state=42,
+        )
+
+    def sweep(
+            self,
+            param_grid: dict,
+            workers: int | None = None,
+            n_neighbors=15,
+            n_components=5,
+            min_dist=0.1,
+            top_n_words=10
+    ) -> pd.DataFrame:
+        """
+        Evaluates every combination of the parameter grid in a process pool and ranks the configurations.
+        The embeddings are reduced once and shared by all configurations. No labels are generated, so the LLM is not
+        called until the chosen configuration is passed to fit_model.
+
+        Every configuration is scored by
+        - outlier_ratio: Share of the responses that are not assigned to a topic (lower is better)
+        - coherence: Mean NPMI of the top words of the topics in the responses (higher is better)
+        - silhouette: Silhouette score of the topics in the reduced embeddings (higher is better)
+
+        The rank is the mean of the percentile ranks of the three scores.
+
+        Example:
+            results = topic_model.sweep({'min_cluster_size': [2, 5, 10], 'cluster_selection_method': ['leaf', 'eom']})
+            topic_model.fit_model(**results.iloc[0]['params'])
+
+        :param param_grid: Dict of parameter names and lists of values. Supported are the parameters in
+            SWEEP_PARAMETERS. Parameters that are not in the grid keep the defaults of fit_model.
+        :param workers: Number of processes. Defaults to the number of CPUs. If 1, the configurations are evaluated
+            in this process.
+        :param n_neighbors: UMAP parameter shared by all configurations
+        :param n_components: UMAP parameter shared by all configurations
+        :param min_dist: UMAP parameter shared by all configurations
+        :param top_n_words: Number of words per topic used for the coherence.
+        :return: DataFrame with one row per configuration, ordered by the rank. The column params holds the
+            arguments for fit_model.
+        """
+        unknown = set(param_grid) - set(SWEEP_PARAMETERS)
+        if unknown:
+            raise Exception(f'Unsupported sweep parameters: {", ".join(sorted(unknown))}')
+
+        names = list(param_grid)
+        configurations = [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+
+        umap_params = {'n_neighbors': n_neighbors, 'n_components': n_components, 'min_dist': min_dist}
+        reduced_embeddings = self._create_umap_model(**umap_params).fit_transform(self.embeddings)
+
+        results = [None] * len(configurations)
+
+        def add_result(i, evaluate):
+            try:
+                scores = evaluate()
+            except Exception as e:
+                logger.warning(f'Configuration {configurations[i]} failed: {e}')
+                scores = {}
+            results[i] = {**configurations[i], **scores, 'params': {**configurations[i], **umap_params}}
+            progress_bar.update(1)
+
+        progress_bar = tqdm(desc='Evaluating configurations', total=len(configurations))
+
+        if workers == 1:
+            _init_sweep_worker(reduced_embeddings, self.docs)
+            for i, params in enumerate(configurations):
+                add_result(i, lambda: _evaluate_configuration(params, top_n_words))
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=workers or os.cpu_count(),
+                    initializer=_init_sweep_worker,
+                    initargs=(reduced_embeddings, self.docs)
+            ) as executor:
+                futures = {
+                    executor.submit(_evaluate_configuration, params, top_n_words): i
+                    for i, params in enumerate(configurations)
+                }
+                for future in as_completed(futures):
+                    add_result(futures[future], future.result)
+
+        progress_bar.close()
+
+        df = pd.DataFrame(results, columns=names + ['n_topics', 'outlier_ratio', 'coherence', 'silhouette', 'params'])
+
+        # Higher ranks are better, missing scores (e.g. the silhouette of a single topic) rank lowest
+        df['rank'] = pd.concat([
+            df['outlier_ratio'].rank(pct=True, ascending=False, na_option='top'),
+            df['coherence'].rank(pct=True, na_option='top'),
+            df['silhouette'].rank(pct=True, na_option='top'),
+        ], axis=1).mean(axis=1)
+
+        return df.sort_values('rank', ascending=False, ignore_index=True)
+
+    def _topic_centroids(self) -> tuple:
+        """
+        Centroids of the normalized embeddings of the fitted responses of every topic, without the outliers.
+
+        :return: Tuple of the topic ids, the centroids (unit length) and the lowest similarity of a fitted response
+            to the centroid of its topic.
+        """
+        topics = np.asarray(self.topic_model.topics_[:self._n_fitted])
+        embeddings = self.normalized_embeddings[:self._n_fitted]
+
+        ids = np.array(sorted(set(topics.tolist()) - {-1}))
+        centroids = np.stack([embeddings[topics == topic].mean(axis=0) for topic in ids])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+        min_similarities = np.array([
+            (embeddings[topics == topic] @ centroid).min() for topic, centroid in zip(ids, centroids)
+        ])
+
+        return ids, centroids, min_similarities
+
+    def _nearest_topics(self, embeddings: np.ndarray, outliers: bool = True) -> tuple:
+        """
+        Assigns embeddings to the topic with the most similar centroid.
+
+        :param embeddings: Embeddings of the responses
+        :param outliers: If True, responses that are less similar to the centroid than all fitted responses of the topic
+            are assigned to -1.
+        :return: Tuple of the topics and the probabilities, i.e. the similarities normalized per response
+            (0 for outliers).
+        """
+        ids, centroids, min_similarities = self._topic_centroids()
+
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        similarities = (embeddings / np.where(norms == 0, 1, norms)) @ centroids.T
+
+        nearest = similarities.argmax(axis=1)
+        topics = ids[nearest]
+
+        probs = np.clip(similarities, 0, None)
+        probs /= np.maximum(probs.sum(axis=1, keepdims=True), 1e-12)
+
+        if outliers:
+            is_outlier = similarities[np.arange(len(nearest)), nearest] < min_similarities[nearest]
+            topics[is_outlier] = -1
+            probs[is_outlier] = 0
+
+        return topics, probs
+
+    def _prediction_reproduces_topics(self) -> bool:
+        """
+        Checks whether the prediction of the clustering model assigns the fitted responses to their topics.
+        The approximate prediction of HDBSCAN may differ from the clustering (e.g. for leaf clusters of a few responses)
+        and is not available without prediction data.
+        """
+        n = self._n_fitted
+
+        try:
+            topics, _ = self.topic_model.transform(self.docs[:n], self.embeddings[:n])
+        except Exception as e:
+            logger.info(f'The clustering model cannot predict topics, responses are assigned to the nearest topic: {e}')
+            return False
+
+        agreement = float(np.mean(np.asarray(topics) == np.asarray(self.topic_model.topics_[:n])))
+
+        if agreement < MIN_PREDICTION_AGREEMENT:
+            logger.info(f'The clustering model predicts the topics of {agreement:.0%} of the fitted responses, '
+                        f'responses are assigned to the nearest topic')
+            return False
+
+        return True
+
+    def _predict(self, docs: list, embeddings: np.ndarray) -> tuple:
+        """
+        Predicts the topics of new responses with the clustering model or, if its prediction does not reproduce the
+        topics of the fitted responses, by the nearest centroid. Responses are only assigned to -1 if the model has an
+        outlier topic, otherwise they are assigned to the nearest topic.
+        """
+        outliers = bool(self.topic_model.get_topic(-1))
+
+        if self._predict_by_centroid is None:
+            self._predict_by_centroid = not self._prediction_reproduces_topics()
+
+        if self._predict_by_centroid:
+            return self._nearest_topics(embeddings, outliers)
+
+        topics, probs = self.topic_model.transform(docs, embeddings)
+        topics = np.array(topics)
+        probs = None if probs is None else np.array(probs, dtype=float)
+
+        is_outlier = topics == -1
+        if not outliers and is_outlier.any():
+            nearest, nearest_probs = self._nearest_topics(embeddings[is_outlier], outliers=False)
+            topics[is_outlier] = nearest
+            if probs is not None:
+                probs[is_outlier] = nearest_probs if probs.ndim == 2 else nearest_probs.max(axis=1)
+
+        return topics, probs
+
+    def _transform(self, responses: pd.Series):
+        # Responses the model already has keep their topics and embeddings
+        positions = self.responses.index.get_indexer(responses.index)
+        known = positions >= 0
+        known[known] = self.responses.to_numpy()[positions[known]] == responses.to_numpy()[known]
+
+        docs = responses.to_list()
+        embeddings = np.zeros((len(docs), np.shape(self.embeddings)[1]), dtype=np.asarray(self.embeddings).dtype)
+        embeddings[known] = np.asarray(self.embeddings)[positions[known]]
+
+        topics = np.full(len(docs), -1)
+        topics[known] = np.asarray(self.topic_model.topics_)[positions[known]]
+
+        fitted_probs = self.topic_model.probabilities_
+        probs = None
+        if fitted_probs is not None:
+            probs = np.zeros((len(docs), *fitted_probs.shape[1:]))
+            probs[known] = fitted_probs[positions[known]]
+
+        if not known.all():
+            new = ~known
+            embeddings[new] = np.asarray(self._encode([doc for doc, is_new in zip(docs, new) if is_new]))
+            new_topics, new_probs = self._predict([doc for doc, is_new in zip(docs, new) if is_new], embeddings[new])
+            topics[new] = new_topics
+            if probs is not None:
+                probs[new] = self._as_fitted_probabilities(new_probs, new_topics)
+
+        df = responses.to_frame(name='response')
+        df['topic'] = topics
+        df['label'] = df['topic'].map(self.topic_labels)
+        if probs is not None:
+            df['prop'] = probs.max(axis=1) if probs.ndim == 2 else probs
+
+        return df, embeddings, probs
+
+    def _as_fitted_probabilities(self, probs: np.ndarray | None, topics: np.ndarray) -> np.ndarray:
+        """
+        Converts predicted probabilities to the shape of the probabilities of the fitted model, i.e. one probability
+        per response or one per response and topic.
+        """
+        fitted_probs = self.topic_model.probabilities_
+
+        if probs is None:
+            probs = np.zeros(len(topics))
+
+        if fitted_probs.ndim == probs.ndim:
+            return probs
+
+        if fitted_probs.ndim == 1:
+            return probs.max(axis=1)
+
+        # Only the probability of the assigned topic is known
+        matrix = np.zeros((len(topics), fitted_probs.shape[1]))
+        assigned = (topics >= 0) & (topics < fitted_probs.shape[1])
+        matrix[assigned, topics[assigned]] = probs[assigned]
+        return matrix
+
+    def transform(self, responses: pd.Series) -> pd.DataFrame:
+        """
+        Assigns topics to responses without changing the model. Responses the model already has keep their topics,
+        new responses are assigned with the prediction data of the fitted model (see _predict).
+
+        :param responses: Series of response texts indexed like the responses of the model.
+        :return: DataFrame with the columns response, topic, label and prop (the probability of the topic).
+        """
+        if len(responses) == 0:
+            return responses.to_frame(name='response').assign(topic=[], label=[], prop=[])
+
+        df, _, _ = self._transform(responses)
+
+        return df
+
+    def update(self, responses: pd.Series, items: pd.DataFrame | None = None) -> pd.DataFrame:
+        """
+        Adds new responses to the model and assigns them to the existing topics without refitting.
+        The keywords, examples and labels of the topics are kept, so the LLM is not called.
+        Responses whose index is already part of the model are skipped.
+
+        Use drift to check whether the new responses still fit the topics.
+
+        :param responses: Series of response texts indexed like the responses of the model.
+            May contain the responses the model already has.
+        :param items: Items of the project including the items of the new responses.
+        :return: The added responses with their topics, see transform.
+        """
+        if items is not None:
+            self._items = items
+
+        new_responses = responses[~responses.index.isin(self.responses.index)]
+
+        if len(new_responses) == 0:
+            logger.info('There are no new responses.')
+            return self.transform(new_responses)
+
+        df, embeddings, probs = self._transform(new_responses)
+
+        self.responses = pd.concat([self.responses, new_responses.rename(self.responses.name)])
+        self.embeddings = np.vstack([self.embeddings, embeddings])
+        self._normalized_embeddings = None
+        self._ann_index = None
+
+        topic_model = self.topic_model
+        topics = list(topic_model.topics_) + df['topic'].to_list()
+        topic_model.topics_ = topics
+        topic_model.topic_sizes_ = collections.Counter(topics)
+
+        if topic_model.probabilities_ is not None:
+            topic_model.probabilities_ = np.concatenate([topic_model.probabilities_, probs])
+
+        self._update_df()
+
+        return df
+
+    def drift(self, max_outlier_increase=0.1, max_divergence=0.2) -> pd.Series:
+        """
+        Compares the responses added by update with the responses the model was fitted on.
+
+        - outlier_ratio_fitted / outlier_ratio_new: Share of the responses without a topic
+        - prop_fitted / prop_new: Mean probability of the assigned topics
+        - divergence: Jensen-Shannon distance between the topic distributions (0: identical, 1: disjoint)
+
+        A refit is recommended if the outlier ratio increased by more than max_outlier_increase or the divergence
+        exceeds max_divergence. Both indicate topics that the fitted model does not know.
+
+        :param max_outlier_increase: Threshold of the increase of the outlier ratio
+        :param max_divergence: Threshold of the divergence
+        :return: Series with the metrics, the number of fitted and new responses and refit_recommended.
+        """
+        topics = np.asarray(self.topic_model.topics_)
+        fitted, new = topics[:self._n_fitted], topics[self._n_fitted:]
+
+        drift = {
+            'fitted_responses': len(fitted),
+            'new_responses': len(new),
+            'outlier_ratio_fitted': float(np.mean(fitted == -1)),
+            'outlier_ratio_new': np.nan,
+            'prop_fitted': np.nan,
+            'prop_new': np.nan,
+            'divergence': np.nan,
+            'refit_recommended': False,
+        }
+
+        if len(new) == 0:
+            return pd.Series(drift)
+
+        drift['outlier_ratio_new'] = float(np.mean(new == -1))
+
+        probs = self.topic_model.probabilities_
+        if probs is not None and len(probs) == len(topics):
+            probs = probs.max(axis=1) if probs.ndim == 2 else probs
+            drift['prop_fitted'] = float(probs[:self._n_fitted].mean())
+            drift['prop_new'] = float(probs[self._n_fitted:].mean())
+
+        labels = np.unique(topics)
+        drift['divergence'] = jensen_shannon_distance(
+            (fitted[:, None] == labels).sum(axis=0).astype(float),
+            (new[:, None] == labels).sum(axis=0).astype(float)
+        )
+
+        drift['refit_recommended'] = bool(
+            drift['outlier_ratio_new'] - drift['outlier_ratio_fitted'] > max_outlier_increase
+            or drift['divergence'] > max_divergence
+        )
+
+        return pd.Series(drift)
+
     def generate_names(self, n=20):
 
         s = ''
@@ -301,7 +1018,7 @@ Give your answer as JSON with the numbers of the topic as the keys:"""
 
             topic_labels[-1] = '-1 Outlier'
 
-            self.topic_model.set_topic_labels(topic_labels)
+            self.set_topic_labels(topic_labels)
 
             return topic_labels
 
@@ -481,6 +1198,7 @@ Give your answer as JSON with the numbers of the topic as the keys:"""
 
     def set_topic_labels(self, topic_labels):
         self.topic_model.set_topic_labels(topic_labels)
+        self._document_info = None
 
     def visualize_topics_over_time(self, normalize=False, include_outliers=False, title=None):
 
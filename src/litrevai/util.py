@@ -3,9 +3,12 @@ import re
 import bibtexparser
 import pandas as pd
 from time import time
+import logging
 
 from litrevai.pdf2text import pdf2text
 
+logger = logging.getLogger(__name__)
+
 
 def strip_references(text):
     # TODO: Bug when there are no references
@@ -77,8 +80,26 @@ def parse_bibtex(path_to_bibtex):
     return entries
 
 
-def get_authors_from_author_field(author_field):
-    pass
+def get_authors_from_author_field(author_field) -> list:
+    """
+    Splits a BibTeX author field of the form `Last, First and Last, First` into names.
+    Names that are not in the form `Last, First` are skipped.
+
+    :param author_field: Value of the `author` field
+    :return: List of (last_name, first_name) tuples
+    """
+    if type(author_field) is not str:
+        return []
+
+    names = []
+    for s in re.split(r'\s+and\s+', author_field.strip()):
+        parts = [part.strip() for part in s.split(',', 1)]
+        if len(parts) != 2 or not all(parts):
+            logger.warning(f'Parsing name {s} failed.')
+            continue
+        names.append((parts[0], parts[1]))
+
+    return names
 
 
 
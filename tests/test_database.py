@@ -0,0 +1,301 @@
+import os
+import sys
+
+sys.path.append('../src')
+
+import pytest
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from litrevai.model.database import Database
+from litrevai.model.migrations import get_latest_version
+from litrevai.model.models import Author, BibliographyItem, Collection, Library, ProjectModel, QueryModel, Response
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = Database(f'sqlite:///{tmp_path}/bibliography.sqlite')
+
+    with db.Session() as session:
+        project = ProjectModel(name='Test Project')
+        items = [BibliographyItem(key=f'item{i}', title=f'Title {i}', text=f'Text {i}') for i in range(3)]
+        project.items.extend(items)
+        query = QueryModel(name='Test Query', question='Is this a test?', type='yes_no', project=project)
+        session.add_all([project, query])
+        session.commit()
+
+    return db
+
+
+def test_answered_keys(database):
+    with database.Session() as session:
+        query = session.query(QueryModel).first()
+        session.add(Response(query=query, item_key='item0', text='Yes'))
+        session.commit()
+
+        assert database.get_answered_keys(session, query.id) == {'item0'}
+
+
+def test_unique_response_per_query_and_item(database):
+    with database.Session() as session:
+        query = session.query(QueryModel).first()
+        session.add(Response(query=query, item_key='item0', text='Yes'))
+        session.add(Response(query=query, item_key='item0', text='No'))
+
+        with pytest.raises(IntegrityError):
+            session.commit()
+
+
+def test_query_dependencies(database):
+    with database.Session() as session:
+        project = session.query(ProjectModel).first()
+        screening = session.query(QueryModel).first()
+        extraction = QueryModel(name='Extraction', question='What is tested?', type='open', project=project)
+        session.add(extraction)
+        session.commit()
+        screening_id, extraction_id = screening.id, extraction.id
+
+    database.add_query_dependency(extraction_id, screening_id, value=True)
+
+    with database.Session() as session:
+        assert database.get_query_dependencies(session, extraction_id) == {screening_id: True}
+        assert database.get_query_dependencies(session, screening_id) == {}
+
+    assert database.remove_query_dependency(extraction_id, screening_id)
+
+
+def test_parsed_values_are_stored(database):
+    with database.Session() as session:
+        query = session.query(QueryModel).first()
+        session.add(Response(query=query, item_key='item0', text='Yes, it is.'))
+        session.add(Response(query=query, item_key='item1', text='No.'))
+        session.commit()
+        query_id = query.id
+
+    responses = database.get_responses_for_query(query_id)
+
+    assert responses.to_dict() == {'item0': True, 'item1': False}
+    assert database.get_responses_for_project(1)['Test Query'].to_dict() == {'item0': True, 'item1': False}
+
+    # Reading does not write
+    with database.Session() as session:
+        versions = {version for version, in session.query(Response.parser_version).all()}
+        assert versions == {None}
+
+    assert database.reparse_responses() == 2
+    assert database.reparse_responses() == 0
+
+    with database.Session() as session:
+        versions = {version for version, in session.query(Response.parser_version).all()}
+        assert versions == {session.get(QueryModel, query_id).prompt.parser_version}
+
+    assert database.get_responses_for_query(query_id).to_dict() == {'item0': True, 'item1': False}
+    assert database.get_responses_for_project(1)['Test Query'].to_dict() == {'item0': True, 'item1': False}
+
+
+def test_items_exclude_text(database):
+    items = database.items
+
+    assert 'text' not in items.columns
+    assert 'text' in database.get_items(include_text=True).columns
+    assert database.get_texts(['item2', 'item0']).to_list() == ['Text 2', 'Text 0']
+
+
+def test_read_items_aggregates_authors(database):
+    with database.Session() as session:
+        item = session.get(BibliographyItem, 'item1')
+        item.authors.append(Author(first_name='Ada', last_name='Lovelace'))
+        session.commit()
+
+    items = database.read_items(BibliographyItem.key.in_(['item0', 'item1']))
+
+    assert items.loc['item1', 'authors'] == ['Lovelace, Ada']
+    assert items.loc['item0', 'authors'] == []
+
+
+def test_compress_texts(database):
+    with database.engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO bibliography_items (key, title, text, synced) VALUES ('legacy', 'Legacy', 'Plain text', 0)"
+        )
+
+    assert database.get_texts(['legacy', 'item0']).to_list() == ['Plain text', 'Text 0']
+
+    database.compress_texts()
+
+    with database.engine.connect() as connection:
+        types = connection.exec_driver_sql('SELECT DISTINCT typeof(text) FROM bibliography_items').scalars().all()
+
+    assert types == ['blob']
+    assert database.get_texts(['legacy', 'item0']).to_list() == ['Plain text', 'Text 0']
+
+
+def test_collection_subtree(database):
+    with database.Session() as session:
+        library = Library(name='Personal')
+        parent = Collection(name='Parent', library=library)
+        child = Collection(name='Child', library=library, parent=parent)
+        session.add_all([library, parent, child])
+        parent.items.append(session.get(BibliographyItem, 'item0'))
+        child.items.append(session.get(BibliographyItem, 'item1'))
+        session.commit()
+        parent_id = parent.id
+
+    database.update_collection_paths()
+
+    assert database.get_collection_id_by_path(os.path.join('Personal', 'Parent', 'Child')) is not None
+    assert sorted(database.read_collection_items(parent_id).index) == ['item0', 'item1']
+
+
+def test_collection_paths_follow_renames(database):
+    with database.Session() as session:
+        library = Library(name='Personal')
+        parent = Collection(name='Parent', library=library)
+        child = Collection(name='Child', library=library, parent=parent)
+        sibling = Collection(name='Child', library=library, parent=parent)
+        session.add_all([library, parent, child, sibling])
+        session.commit()
+        child_id = child.id
+
+    # Sibling collections may have the same name
+    assert database.get_collection_id_by_path(os.path.join('Personal', 'Parent', 'Child')) == child_id
+
+    with database.Session() as session:
+        session.get(Collection, child_id).parent.name = 'Renamed'
+        session.commit()
+
+    assert database.get_collection_id_by_path(os.path.join('Personal', 'Renamed', 'Child')) == child_id
+
+    with database.Session() as session:
+        session.get(Collection, child_id).library.name = 'Group'
+        session.commit()
+
+    assert database.get_collection_id_by_path(os.path.join('Group', 'Renamed', 'Child')) == child_id
+    assert database.get_collection_id_by_path(os.path.join('Personal', 'Renamed', 'Child')) is None
+
+
+def test_performance_profile(database, tmp_path):
+    with database.engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'delete'
+
+    performance = Database(f'sqlite:///{tmp_path}/performance.sqlite', profile='performance')
+
+    with performance.engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+
+    with database.session_scope() as session:
+        session.add(ProjectModel(name='Another Project'))
+
+    assert len(database.projects) == 2
+
+
+def test_migrate_existing_database(tmp_path):
+    url = f'sqlite:///{tmp_path}/legacy.sqlite'
+    engine = create_engine(url)
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql('CREATE TABLE responses (id INTEGER PRIMARY KEY, text VARCHAR, query_id INTEGER, item_key VARCHAR)')
+        connection.exec_driver_sql("INSERT INTO responses (text, query_id, item_key) VALUES ('No', 1, 'item0'), ('Yes', 1, 'item0')")
+
+    database = Database(url)
+
+    with database.engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA user_version').scalar() == get_latest_version()
+        assert connection.exec_driver_sql('SELECT text FROM responses').scalars().all() == ['Yes']
+        assert connection.exec_driver_sql('SELECT text FROM responses_duplicates').scalars().all() == ['No']
+
+    indexes = {index['name'] for index in inspect(database.engine).get_indexes('responses')}
+    assert {'ix_responses_query_item', 'ix_responses_item_key'} <= indexes
+
+
+def test_add_items_by_bibtex(database):
+    entries = [
+        ('new0', {'title': 'New 0', 'author': 'Lovelace, Ada and Turing, Alan'}, 'Text'),
+        ('new1', {'title': 'New 1', 'author': 'Turing, Alan and\n Hopper, Grace'}, None),
+        ('item0', {'title': 'Existing', 'author': 'Hopper, Grace'}, None),
+    ]
+
+    with database.Session() as session:
+        project_id = session.query(ProjectModel.id).scalar()
+
+    assert database.add_items_by_bibtex(entries, project_id=project_id) == ['new0', 'new1']
+    assert database.add_items_by_bibtex(entries[:1]) == []
+
+    items = database.read_items(BibliographyItem.key.in_(['new0', 'new1', 'item0']))
+
+    assert items.loc['new0', 'authors'] == ['Lovelace, Ada', 'Turing, Alan']
+    assert items.loc['new1', 'authors'] == ['Turing, Alan', 'Hopper, Grace']
+    assert items.loc['item0', 'authors'] == []
+
+    with database.Session() as session:
+        assert session.query(Author).count() == 3
+        assert len(session.get(ProjectModel, project_id).items) == 5
+
+
+def test_existing_keys_and_synced(database):
+    assert database.get_existing_keys(['item0', 'item2', 'missing']) == {'item0', 'item2'}
+
+    database.set_synced(['item0', 'item1'])
+
+    with database.Session() as session:
+        synced = session.scalars(select(BibliographyItem.key).where(BibliographyItem.synced == True)).all()
+
+    assert sorted(synced) == ['item0', 'item1']
+
+
+def test_add_items_by_bibtex_update_existing(database):
+    database.set_synced(['item0'])
+
+    database.add_items_by_bibtex([('item0', {'title': 'Updated'}, 'New text')], update_existing=True)
+
+    with database.Session() as session:
+        item = session.get(BibliographyItem, 'item0')
+        assert (item.title, item.synced) == ('Updated', False)
+
+    assert database.get_texts(['item0']).to_list() == ['New text']
+
+
+def test_keyword_search(database):
+    database.add_items_by_bibtex([
+        ('llm', {'title': 'Large language models', 'abstract': 'A survey'}, 'We evaluate language models on reviews.'),
+        ('other', {'title': 'Topic modelling'}, 'Clustering documents with language.'),
+    ])
+
+    results = database.keyword_search('language survey')
+    assert results.index.tolist() == ['llm']
+    assert '[language]' in results.loc['llm', 'snippet']
+
+    assert database.keyword_search('language', keys=['other']).index.tolist() == ['other']
+    assert database.keyword_search('"large language" OR clustering', raw=True).index.tolist() == ['llm', 'other']
+
+    with database.Session() as session:
+        session.get(BibliographyItem, 'item0').title = 'Language'
+        session.delete(session.get(BibliographyItem, 'other'))
+        session.commit()
+
+    assert sorted(database.keyword_search('language').index) == ['item0', 'llm']
+    assert sorted(database.keyword_search('title').index) == ['item1', 'item2']
+    assert database.keyword_search('language', snippets=False)['snippet'].isna().all()
+
+    # The index does not store the texts
+    assert 'items_fts_content' not in inspect(database.engine).get_table_names()
+    assert database.keyword_search('text', keys=['item1']).loc['item1', 'snippet'] == '[Text] 1'
+
+
+def test_search_authors(database):
+    database.add_items_by_bibtex([
+        ('new0', {'author': 'Lovelace, Ada and Müller-Lüdenscheidt, Jürgen'}, None),
+        ('new1', {'author': 'Love, Courtney'}, None),
+    ])
+
+    assert database.search_authors('lovel ada')[['first_name', 'last_name']].values.tolist() == [['Ada', 'Lovelace']]
+    assert database.search_authors('LUDENSCHEIDT')['last_name'].tolist() == ['Müller-Lüdenscheidt']
+    assert database.search_authors('love')['last_name'].tolist() == ['Love', 'Lovelace']
+    assert database.search_authors('lovlace', fuzzy=True)['last_name'].tolist()[0] == 'Lovelace'
+
+    with database.Session() as session:
+        author = session.query(Author).where(Author.last_name == 'Love').one()
+        author.last_name = 'Hole'
+        session.commit()
+
+    assert database.search_authors('love')['last_name'].tolist() == ['Lovelace']
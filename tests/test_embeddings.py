@@ -0,0 +1,117 @@
+import os
+import sys
+import types
+
+sys.path.append('../src')
+
+import numpy as np
+import pytest
+
+from litrevai import embeddings
+
+
+class FakeSentenceTransformer:
+    loaded = 0
+
+    def __init__(self, name, device=None, trust_remote_code=False):
+        FakeSentenceTransformer.loaded += 1
+        self.name = name
+        self.device = device
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    module = types.ModuleType('sentence_transformers')
+    module.SentenceTransformer = FakeSentenceTransformer
+    monkeypatch.setitem(sys.modules, 'sentence_transformers', module)
+    FakeSentenceTransformer.loaded = 0
+    yield embeddings
+    embeddings.unload_embedding_model()
+
+
+def test_models_are_shared_by_name_and_device(registry):
+    model = registry.get_embedding_model('model-a', 'cpu')
+
+    assert registry.get_embedding_model('model-a', 'cpu') is model
+    assert registry.get_embedding_model('model-b', 'cpu') is not model
+    assert registry.get_embedding_model('model-a', 'cuda:1') is not model
+    assert FakeSentenceTransformer.loaded == 3
+
+
+def test_unload(registry):
+    registry.get_embedding_model('model-a', 'cpu')
+    registry.get_embedding_model('model-b', 'cpu')
+
+    assert registry.unload_embedding_model('model-a') == 1
+    assert registry.loaded_embedding_models() == [('model-b', 'cpu')]
+
+    registry.get_embedding_model('model-a', 'cpu')
+    assert FakeSentenceTransformer.loaded == 3
+
+
+class CountingModel:
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        return np.array([[len(text), text.count('a')] for text in texts], dtype=np.float32)
+
+
+def test_embedding_cache(tmp_path):
+    model = CountingModel()
+    cache = embeddings.EmbeddingCache(str(tmp_path), 'org/model')
+
+    first = cache.encode(['abc', 'aaaa'], model)
+    second = cache.encode(['aaaa', 'abc', 'b', 'abc'], model)
+
+    assert model.encoded == ['abc', 'aaaa', 'b']
+    assert first.tolist() == [[3, 1], [4, 4]]
+    assert second.tolist() == [[4, 4], [3, 1], [1, 0], [3, 1]]
+
+    reopened = embeddings.EmbeddingCache(str(tmp_path), 'org/model')
+    assert len(reopened) == 3
+    assert reopened.encode(['b', 'abc'], model).tolist() == [[1, 0], [3, 1]]
+    assert model.encoded == ['abc', 'aaaa', 'b']
+
+
+def test_embedding_cache_compacts_shards(tmp_path):
+    model = CountingModel()
+    cache = embeddings.EmbeddingCache(str(tmp_path), 'org/model', max_shards=2)
+
+    for text in ['a', 'ab', 'abc', 'abcd', 'ab']:
+        cache.encode([text], model)
+
+    files = os.listdir(cache.path)
+    assert len([file for file in files if file.endswith('.keys.npy')]) <= 2
+    assert not any(file.endswith('.tmp') for file in files)
+
+    reopened = embeddings.EmbeddingCache(str(tmp_path), 'org/model', max_shards=2)
+    assert len(reopened) == 4
+    assert reopened.encode(['abcd', 'a'], model).tolist() == [[4, 1], [1, 1]]
+    assert model.encoded == ['a', 'ab', 'abc', 'abcd']
+
+
+def test_embedding_cache_loads_while_compacting(tmp_path, monkeypatch):
+    model = CountingModel()
+    writer = embeddings.EmbeddingCache(str(tmp_path), 'org/model')
+
+    for text in ['a', 'ab', 'abc']:
+        writer.encode([text], model)
+
+    add_shard = embeddings.EmbeddingCache._add_shard
+
+    def compact_first(cache, shard_id):
+        # Another process compacts the cache after the shards were listed
+        monkeypatch.setattr(embeddings.EmbeddingCache, '_add_shard', add_shard)
+        writer.compact()
+        add_shard(cache, shard_id)
+
+    monkeypatch.setattr(embeddings.EmbeddingCache, '_add_shard', compact_first)
+    reader = embeddings.EmbeddingCache(str(tmp_path), 'org/model')
+
+    assert len(reader) == 3
+    assert len(reader._shard_ids) == 1
+    assert reader.encode(['abc'], model).tolist() == [[3, 1]]
+    assert model.encoded == ['a', 'ab', 'abc']
@@ -38,6 +38,29 @@ def test_import_documents(db):
     assert 'hoperLearningExplanatoryModel2024' in items.index
 
 
+def test_keyword_without_matches(db):
+    lr = LiteratureReview(db)
+
+    assert lr.search('programming', keyword='xyzzy').empty
+    assert lr.vs.rag('How is programming taught?', keyword='xyzzy') == ('', '')
+
+
+def test_context_cache_is_bounded(db):
+    lr = LiteratureReview(db)
+    lr.vs.context_cache_size = 2
+    lr.vs.clear_context_cache()
+
+    prompt = OpenPrompt(question='What is programming?')
+    keys = lr.items.index[:3].tolist()
+
+    for key in keys:
+        lr.vs.retrieve(prompt, keys=key, cache=True)
+
+    assert len(lr.vs._context_cache) == min(2, len(keys))
+
+    lr.vs.clear_context_cache()
+
+
 def test_create_project(db):
 
     lr = LiteratureReview(db)
@@ -59,7 +82,8 @@ def test_create_project(db):
     assert isinstance(items, pd.DataFrame)
     assert 'title' in items.columns
     assert len(items) > 0
-    assert len(items.iloc[0].text) > 0
+    assert 'text' not in items.columns
+    assert len(project.get_texts().iloc[0]) > 0
 
 def test_create_query(db):
 
@@ -96,6 +120,24 @@ def test_create_query(db):
     assert len(query.responses) > 0
 
 
+def test_run_project_concurrently(db):
+    lr = LiteratureReview(db, llm=OpenAIModel(), db_profile='performance')
+
+    project = lr.projects.get(project_name)
+
+    project.create_query(name='Methods', prompt=OpenPrompt(question='Which research methods are used?'))
+    project.create_query(name='Population', prompt=OpenPrompt(question='Who are the participants?'))
+
+    # Contexts cached by the dry run are consumed concurrently by the workers
+    project.estimate()
+    project.run(workers=2)
+
+    for name in ['Methods', 'Population']:
+        assert len(project.queries.get(name).responses.dropna()) > 0
+
+    assert len(lr.vs._context_cache) == 0
+
+
 def test_topic_model(db):
     llm = OpenAIModel()
 
@@ -115,6 +157,48 @@ def test_topic_model(db):
 
     assert isinstance(topic_model, TopicModel)
 
+    documents = topic_model.find_document(topic_model.docs[0], top_n=3, use_ann=False)
+
+    assert len(documents) == min(3, len(topic_model.docs))
+    assert documents['similarities'].is_monotonic_decreasing
+    assert documents['similarities'].iloc[0] > 0.99
+
+    n_docs = len(topic_model.docs)
+    assert len(topic_model.find_document(topic_model.docs[0], top_n=n_docs + 10, use_ann=False)) == n_docs
+
+    results = topic_model.sweep({'min_cluster_size': [2, 3], 'cluster_selection_method': ['leaf', 'eom']}, workers=1)
+
+    assert len(results) == 4
+    assert results['rank'].is_monotonic_decreasing
+    assert results['outlier_ratio'].between(0, 1).all()
+
+    assigned = topic_model.transform(topic_model.responses)
+
+    # The fitted responses get their own topics back
+    assert assigned['topic'].tolist() == topic_model.topic_model.topics_
+
+    # The query has no responses that the topic model does not know yet
+    assert len(query.update_topic_model(topic_model)) == 0
+
+    drift = topic_model.drift()
+
+    assert drift['new_responses'] == 0
+    assert not drift['refit_recommended']
+
+    responses = topic_model.responses
+    unseen = pd.Series(['A completely different answer.', *responses.iloc[:2]], index=[f'unseen{i}' for i in range(3)])
+    if isinstance(responses.index, pd.MultiIndex):
+        unseen.index = pd.MultiIndex.from_arrays([unseen.index, [0] * 3], names=responses.index.names)
+
+    updated = topic_model.update(unseen)
+
+    assert len(updated) == 3
+    assert set(updated['topic']) <= set(topic_model.topics.index)
+
+    assert len(topic_model.get_document_info()) == n_docs + 3
+    assert topic_model.drift()['new_responses'] == 3
+    assert len(topic_model.propability_matrix()) == n_docs + 3
+
 def test_delete_projects(db):
 
     lr = LiteratureReview(db)
@@ -0,0 +1,74 @@
+import sys
+
+sys.path.append('../src')
+
+import pytest
+from sqlalchemy import select, text as sql_text
+
+from litrevai.model import search_index
+from litrevai.model.database import Database
+from litrevai.model.models import Author, BibliographyItem, Response, item_author_association, \
+    item_collection_association, item_tag_association, item_project_association
+
+
+@pytest.fixture(scope='module')
+def database(tmp_path_factory):
+    path = tmp_path_factory.mktemp('plans')
+    return Database(f'sqlite:///{path}/bibliography.sqlite')
+
+
+def uses_index(plan, index=None):
+    """
+    True if no step of the plan scans a whole table and the given index is used.
+    """
+    if any(step.startswith('SCAN') for step in plan):
+        return False
+    return index is None or any(index in step for step in plan)
+
+
+@pytest.mark.parametrize('statement, index', [
+    (select(Response.id).where(Response.query_id == 1), 'ix_responses_query_item'),
+    (select(Response.id).where(Response.query_id == 1, Response.item_key == 'a'), 'ix_responses_query_item'),
+    (select(Response.id).where(Response.item_key == 'a'), 'ix_responses_item_key'),
+    (select(Author.id).where(Author.last_name == 'Lovelace'), 'ix_authors_name'),
+    (select(Author.id).where(Author.last_name == 'Lovelace', Author.first_name == 'Ada'), 'ix_authors_name'),
+    (select(BibliographyItem.key).where(BibliographyItem.zotero_key == 'ABCD1234'), None),
+    (select(BibliographyItem.key).where(BibliographyItem.DOI == '10.1000/1'), 'ix_bibliography_items_DOI'),
+])
+def test_lookup_uses_index(database, statement, index):
+    plan = database.explain(statement)
+    assert uses_index(plan, index), plan
+
+
+@pytest.mark.parametrize('table', [
+    item_author_association,
+    item_collection_association,
+    item_tag_association,
+    item_project_association,
+])
+def test_association_lookup_by_item_uses_index(database, table):
+    statement = select(table).where(table.c.bibliography_key == 'a')
+    plan = database.explain(statement)
+    assert uses_index(plan, f'ix_{table.name}_bibliography_key'), plan
+
+
+def test_read_items_does_not_scan_associations(database):
+    plan = database.explain(
+        'SELECT bibliography_items.key, group_concat(authors.last_name) FROM bibliography_items '
+        'JOIN item_author ON item_author.bibliography_key = bibliography_items.key '
+        'JOIN authors ON authors.id = item_author.author_id '
+        "WHERE bibliography_items.key IN ('a', 'b') GROUP BY bibliography_items.key"
+    )
+    assert not any(step.startswith('SCAN item_author') for step in plan), plan
+
+
+@pytest.mark.parametrize('sql', [
+    f"SELECT rowid FROM items_fts WHERE items_fts MATCH 'language' AND rowid IN ({search_index.ITEM_ROWIDS})",
+    f'SELECT rowid FROM items_fts WHERE rowid IN ({search_index.ITEM_ROWIDS})',
+])
+def test_search_index_lookup_by_key_uses_rowid(database, sql):
+    plan = database.explain(sql_text(sql).bindparams(keys='["a"]'))
+    # Virtual tables are always listed as SCAN, the constraint on the rowid is shown after the index number
+    fts_steps = [step for step in plan if step.startswith('SCAN items_fts')]
+    assert fts_steps and all('=' in step for step in fts_steps), plan
+    assert not any(step.startswith('SCAN items_fts_keys') for step in plan), plan